@@ -0,0 +1,100 @@
+import argparse
+
+# Precomputed dashboard counters. Triggers created by migrations 6 and 9 keep
+# these tables current on every write; the queries below recompute them from
+# the base tables, for the initial fill and for the consistency check.
+BORROWED_STATUSES = "('granted', 'returned', 'expired')"
+
+AGGREGATES = {
+    "ebook_stats": (
+        "ebook_id",
+        ("request_count", "borrow_count", "feedback_count", "last_feedback_date"),
+        f"""
+        SELECT ebook_id,
+               SUM(requests) AS request_count,
+               SUM(borrows) AS borrow_count,
+               SUM(feedbacks) AS feedback_count,
+               MAX(last_feedback_date) AS last_feedback_date
+        FROM (
+            SELECT ebook_id, 1 AS requests, status IN {BORROWED_STATUSES} AS borrows,
+                   0 AS feedbacks, NULL AS last_feedback_date
+            FROM ebook_requests
+            UNION ALL
+            SELECT ebook_id, 0, 0, 1, feedback_date FROM feedback
+        )
+        -- Counters of deleted ebooks are dropped with them (migration 9)
+        WHERE ebook_id IN (SELECT id FROM ebooks)
+        GROUP BY ebook_id
+        """,
+    ),
+    "user_request_stats": (
+        "user_id",
+        ("total_requests", "granted_requests"),
+        """
+        SELECT user_id,
+               COUNT(*) AS total_requests,
+               SUM(status = 'granted') AS granted_requests
+        FROM ebook_requests
+        GROUP BY user_id
+        """,
+    ),
+    "section_stats": (
+        "section_id",
+        ("ebook_count",),
+        """
+        SELECT section_id, COUNT(*) AS ebook_count
+        FROM ebooks
+        GROUP BY section_id
+        """,
+    ),
+}
+
+
+# Recompute every aggregate table from the base tables
+def rebuild_aggregates(conn):
+    for table, (key, columns, query) in AGGREGATES.items():
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f"INSERT INTO {table} ({key}, {', '.join(columns)}) {query}")
+
+
+def _nonzero(rows):
+    # Rows whose counters all dropped back to zero are equivalent to no row
+    return {
+        row[0]: tuple(row[1:])
+        for row in rows
+        if any(value for value in row[1:])
+    }
+
+
+# Compare the maintained tables with a fresh computation. Returns a list of
+# (table, key, stored, expected) for every row that differs.
+def check_aggregates(conn):
+    mismatches = []
+    for table, (key, columns, query) in AGGREGATES.items():
+        stored = _nonzero(conn.execute(f"SELECT {key}, {', '.join(columns)} FROM {table}"))
+        expected = _nonzero(conn.execute(query))
+        for id in sorted(stored.keys() | expected.keys()):
+            if stored.get(id) != expected.get(id):
+                mismatches.append((table, id, stored.get(id), expected.get(id)))
+    return mismatches
+
+
+if __name__ == "__main__":
+    from db import get_db_connection
+
+    parser = argparse.ArgumentParser(description="Check or rebuild the dashboard aggregates")
+    parser.add_argument("--rebuild", action="store_true", help="recompute every aggregate table")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    mismatches = check_aggregates(conn)
+    for table, id, stored, expected in mismatches:
+        print(f"{table} {id}: stored {stored}, expected {expected}")
+    if not mismatches:
+        print("Aggregates are consistent.")
+    if args.rebuild:
+        conn.execute("BEGIN")
+        rebuild_aggregates(conn)
+        conn.commit()
+        print("Aggregates rebuilt.")
+    conn.close()
@@ -1,10 +1,10 @@
 import os
-from flask import Flask
+import sqlite3
+from flask import Blueprint, Flask, jsonify
 from flask_cors import CORS
-from db import init_db
+from db import DatabaseBusy, init_db, is_locked_error, pool
 from flask_jwt_extended import JWTManager
 from cache import cache
-import redis
 from dotenv import load_dotenv
 from datetime import timedelta
 
@@ -14,46 +14,157 @@ from users import users_bp
 from ebook_requests import ebook_requests_bp
 from feedback import feedback_bp
 from stats import stats_bp
+from search import search_bp
+from imports import imports_bp
+from changes import changes_bp
+from scheduler import scheduler
+from passwords import hash_pool
+from write_queue import WriteQueueBusy, write_queue
+import metrics
+import compression
 
 # Load environment variables from .env file
 load_dotenv()
 
-app = Flask(__name__)
-
-# Configure cache with environment variables
-app.config["CACHE_TYPE"] = "redis"
-app.config["CACHE_REDIS_HOST"] = os.getenv("CACHE_REDIS_HOST")
-app.config["CACHE_REDIS_PORT"] = int(os.getenv("CACHE_REDIS_PORT") or "")
-app.config["CACHE_REDIS_PASSWORD"] = os.getenv("CACHE_REDIS_PASSWORD")
-app.config["CACHE_REDIS_DB"] = int(os.getenv("CACHE_REDIS_DB") or 0)
-app.config["CACHE_DEFAULT_TIMEOUT"] = int(os.getenv("CACHE_DEFAULT_TIMEOUT") or 300)
-
-# Initialize cache
-cache.init_app(app)
-redis_client = redis.Redis(
-    host=os.getenv("CACHE_REDIS_HOST") or "localhost",
-    port=int(os.getenv("CACHE_REDIS_PORT") or "123123"),
-    password=os.getenv("CACHE_REDIS_PASSWORD")
-)
-
-CORS(app)
-app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY")
-app.config['JWTT_ACCESS_TOKEN_EXPIRES'] = timedelta(days=30)
-jwt = JWTManager(app)
-
-# Register the blueprints
-app.register_blueprint(ebooks_bp)
-app.register_blueprint(sections_bp)
-app.register_blueprint(users_bp)
-app.register_blueprint(ebook_requests_bp)
-app.register_blueprint(feedback_bp)
-app.register_blueprint(stats_bp)
-
-init_db()
-
-@app.route("/", methods=["GET"])
+# Health and stats endpoints
+ops_bp = Blueprint("ops", __name__)
+
+@ops_bp.route("/", methods=["GET"])
 def is_api_up():
     return "API is running."
 
+@ops_bp.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return metrics.metrics_response()
+
+@ops_bp.route("/db-stats", methods=["GET"])
+def db_stats():
+    return jsonify(pool.stats())
+
+@ops_bp.route("/cache-stats", methods=["GET"])
+def cache_stats():
+    return jsonify(cache.cache.stats())
+
+@ops_bp.route("/hash-stats", methods=["GET"])
+def hash_stats():
+    return jsonify(hash_pool.stats())
+
+@ops_bp.route("/scheduler-stats", methods=["GET"])
+def scheduler_stats():
+    return jsonify(scheduler.stats())
+
+@ops_bp.route("/write-queue-stats", methods=["GET"])
+def write_queue_stats():
+    return jsonify(write_queue.stats())
+
+# A write that still finds the database locked after its retries, or a
+# full write queue, can be retried by the client: 503 rather than 500
+@ops_bp.app_errorhandler(DatabaseBusy)
+@ops_bp.app_errorhandler(WriteQueueBusy)
+@ops_bp.app_errorhandler(sqlite3.OperationalError)
+def database_busy(error):
+    if not isinstance(error, (DatabaseBusy, WriteQueueBusy)) and not is_locked_error(error):
+        raise error
+    return jsonify({"message": "The library is busy, please try again!"}), 503, {"Retry-After": "1"}
+
+# Cache and pool counters exported next to the request metrics
+metrics.registry.register(metrics.Collected(
+    "cache_lookups_total", "counter", "Cache lookups by outcome", ("result",),
+    lambda: {(result,): cache.cache.stats()[key] for result, key in (("l1_hit", "l1_hits"), ("l2_hit", "l2_hits"), ("miss", "misses"))},
+))
+metrics.registry.register(metrics.Collected(
+    "cache_evictions_total", "counter", "In-process cache entries evicted for space", (),
+    lambda: {(): cache.cache.stats()["l1_evictions"]},
+))
+metrics.registry.register(metrics.Collected(
+    "db_connections_open", "gauge", "Pooled SQLite connections", (),
+    lambda: {(): pool.stats()["open_connections"]},
+))
+metrics.registry.register(metrics.Collected(
+    "write_queue_depth", "gauge", "Writes waiting for the group commit", (),
+    lambda: {(): write_queue.stats()["queued"]},
+))
+metrics.registry.register(metrics.Collected(
+    "db_lock_waits_total", "counter", "Write transactions that waited for the write lock", (),
+    lambda: {(): pool.stats()["lock_waits"]},
+))
+metrics.registry.register(metrics.Collected(
+    "db_lock_wait_seconds_total", "counter", "Time spent waiting for the write lock", (),
+    lambda: {(): pool.stats()["lock_wait_seconds"]},
+))
+metrics.registry.register(metrics.Collected(
+    "db_lock_retries_total", "counter", "Write transactions retried after a lock timeout", (),
+    lambda: {(): pool.stats()["lock_retries"]},
+))
+metrics.registry.register(metrics.Collected(
+    "db_lock_failures_total", "counter", "Write transactions that gave up on the write lock", (),
+    lambda: {(): pool.stats()["lock_failures"]},
+))
+
+
+# Settings read from the environment; create_app(config) overrides them
+def default_config():
+    return {
+        # Redis is the optional shared tier behind the in-process cache;
+        # leave CACHE_REDIS_HOST unset to run without it
+        "CACHE_TYPE": "layered_cache.LayeredCache",
+        "CACHE_REDIS_HOST": os.getenv("CACHE_REDIS_HOST"),
+        "CACHE_REDIS_URL": os.getenv("CACHE_REDIS_URL"),
+        "CACHE_REDIS_PORT": int(os.getenv("CACHE_REDIS_PORT") or 6379),
+        "CACHE_REDIS_PASSWORD": os.getenv("CACHE_REDIS_PASSWORD"),
+        "CACHE_REDIS_DB": int(os.getenv("CACHE_REDIS_DB") or 0),
+        "CACHE_DEFAULT_TIMEOUT": int(os.getenv("CACHE_DEFAULT_TIMEOUT") or 300),
+        "CACHE_L1_MAX_BYTES": int(os.getenv("CACHE_L1_MAX_BYTES") or 64 * 1024 * 1024),
+        "CACHE_L1_MAX_ITEMS": int(os.getenv("CACHE_L1_MAX_ITEMS") or 10000),
+        "CACHE_L1_TTL": int(os.getenv("CACHE_L1_TTL") or 30),
+        "DATABASE_PATH": os.getenv("DATABASE_PATH") or "database.db",
+        "JWT_SECRET_KEY": os.getenv("JWT_SECRET_KEY"),
+        "JWTT_ACCESS_TOKEN_EXPIRES": timedelta(days=30),
+        # Apply migrations while creating the app
+        "INIT_DB": True,
+        # Run background jobs, e.g. expiring overdue requests, in this process
+        "SCHEDULER_ENABLED": os.getenv("SCHEDULER_ENABLED", "1") == "1",
+        # Commit feedback and ebook request inserts in batches on a writer
+        # thread, answering once committed ("durable") or queued ("queued")
+        "WRITE_QUEUE_ENABLED": os.getenv("WRITE_QUEUE_ENABLED", "0") == "1",
+        "WRITE_QUEUE_ACK": os.getenv("WRITE_QUEUE_ACK") or "durable",
+    }
+
+
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config.update(default_config())
+    app.config.update(config or {})
+
+    pool.init_app(app)
+    cache.init_app(app)
+    metrics.init_app(app)
+    compression.init_app(app)
+    write_queue.init_app(app)
+    CORS(app, expose_headers=["X-Next-Cursor", "X-Next-Offset"])
+    JWTManager(app)
+
+    # Register the blueprints
+    app.register_blueprint(ops_bp)
+    app.register_blueprint(ebooks_bp)
+    app.register_blueprint(sections_bp)
+    app.register_blueprint(users_bp)
+    app.register_blueprint(ebook_requests_bp)
+    app.register_blueprint(feedback_bp)
+    app.register_blueprint(stats_bp)
+    app.register_blueprint(search_bp)
+    app.register_blueprint(imports_bp)
+    app.register_blueprint(changes_bp)
+
+    if app.config["INIT_DB"]:
+        init_db()
+
+    if app.config["SCHEDULER_ENABLED"]:
+        scheduler.start(app)
+
+    return app
+
+
 if __name__ == "__main__":
-    app.run(debug=True)
+    # Development server; see serve.py for production
+    create_app().run(debug=True)
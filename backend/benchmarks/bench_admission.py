@@ -0,0 +1,121 @@
+# Stress test of POST /ebook_requests: many threads submit requests for a
+# few users at once, each thread on its own SQLite connection, next to
+# threads writing feedback. Checks that no user ends up with more open
+# requests than allowed and reports throughput and write lock counters.
+#
+#   python benchmarks/bench_admission.py --clients 16 --seconds 10
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import datagen  # noqa: E402
+from app import create_app  # noqa: E402
+from db import get_db_connection, pool  # noqa: E402
+from ebook_requests import MAX_OPEN_REQUESTS  # noqa: E402
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] if samples else float("nan")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stress test request admission")
+    parser.add_argument("--clients", type=int, default=16, help="threads submitting requests")
+    parser.add_argument("--writers", type=int, default=4, help="threads writing feedback alongside")
+    parser.add_argument("--users", type=int, default=20, help="users the requests are spread over")
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    app = create_app({
+        "DATABASE_PATH": os.path.join(tempfile.mkdtemp(), "bench.db"),
+        "CACHE_REDIS_HOST": None,
+        "CACHE_REDIS_URL": None,
+        "JWT_SECRET_KEY": "bench",
+        "SCHEDULER_ENABLED": False,
+    })
+    conn = get_db_connection()
+    datagen.generate(conn, users=args.users, ebooks=1000, requests=0, feedback=0, content_kb=1)
+    user_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE role = 'user'")]
+    ebook_ids = [row[0] for row in conn.execute("SELECT id FROM ebooks")]
+    conn.close()
+
+    token = app.test_client().post("/login-user", json={"username": "user1", "password": datagen.PASSWORD}).json["token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    deadline = time.monotonic() + args.seconds
+    statuses = Counter()
+    latencies = []
+    lock = threading.Lock()
+
+    def submit(index):
+        rng = random.Random(index)
+        client = app.test_client()
+        local, seen = [], Counter()
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            response = client.post("/ebook_requests", headers=headers, json={
+                "user_id": rng.choice(user_ids),
+                "ebook_id": rng.choice(ebook_ids),
+                "return_date": "2099-01-01",
+            })
+            local.append((time.perf_counter() - started) * 1000)
+            seen[response.status_code] += 1
+            # Return an open request now and then so admissions continue
+            if rng.random() < 0.3:
+                conn = get_db_connection()
+                row = conn.execute("SELECT MAX(id) FROM ebook_requests WHERE status = 'requested'").fetchone()
+                conn.close()
+                if row[0]:
+                    client.put(f"/ebook_requests/{rng.randint(max(1, row[0] - 50), row[0])}", json={"status": "returned"})
+        with lock:
+            latencies.extend(local)
+            statuses.update(seen)
+
+    def write_feedback(index):
+        rng = random.Random(-index)
+        client = app.test_client()
+        while time.monotonic() < deadline:
+            client.post("/feedback", json={
+                "user_id": rng.choice(user_ids), "ebook_id": rng.choice(ebook_ids), "feedback": "Stress test",
+            })
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(args.clients)]
+    threads += [threading.Thread(target=write_feedback, args=(i,)) for i in range(args.writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    conn = get_db_connection()
+    over = conn.execute(
+        """
+        SELECT user_id, COUNT(*) FROM ebook_requests
+        WHERE status = 'requested'
+        GROUP BY user_id
+        HAVING COUNT(*) > ?
+    """,
+        (MAX_OPEN_REQUESTS,),
+    ).fetchall()
+    conn.close()
+
+    latencies.sort()
+    total = sum(statuses.values())
+    print(f"submissions    {total} in {elapsed:.1f}s ({total / elapsed:.1f}/s)")
+    print(f"statuses       {dict(sorted(statuses.items()))}")
+    print(f"latency ms     p50 {percentile(latencies, 0.5):.2f}  p95 {percentile(latencies, 0.95):.2f}  "
+          f"p99 {percentile(latencies, 0.99):.2f}")
+    stats = pool.stats()
+    print(f"write lock     waits {stats['lock_waits']}  waited {stats['lock_wait_seconds']:.3f}s  "
+          f"retries {stats['lock_retries']}  failures {stats['lock_failures']}")
+    if over:
+        print(f"LIMIT EXCEEDED for {len(over)} users: {[tuple(row) for row in over]}")
+        sys.exit(1)
+    print(f"limit held     no user has more than {MAX_OPEN_REQUESTS} open requests")
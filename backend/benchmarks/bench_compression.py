@@ -0,0 +1,74 @@
+# CPU time per request and bytes on the wire for the cached catalog
+# endpoints, uncompressed, compressed on every hit, and served from the
+# compressed copies stored with the cache entry.
+#
+#   python benchmarks/bench_compression.py --ebooks 10000 --requests 200
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compression  # noqa: E402
+import datagen  # noqa: E402
+from app import create_app  # noqa: E402
+from cache import cache  # noqa: E402
+from db import get_db_connection  # noqa: E402
+
+PATHS = ("/ebooks?limit=500", "/ebooks", "/ebooks/requests", "/sections")
+
+
+# (label, Accept-Encoding, compress cached entries up front)
+def modes():
+    found = [("identity", "identity", True)]
+    for encoding in compression.ENCODINGS:
+        found.append((f"{encoding} per hit", encoding, False))
+        found.append((f"{encoding} cached", encoding, True))
+    return found
+
+
+def measure(client, path, headers, requests):
+    client.get(path, headers=headers)  # fill the cache
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    for _ in range(requests):
+        response = client.get(path, headers=headers)
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    return cpu / requests * 1000, wall / requests * 1000, len(response.get_data())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare response compression modes")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--ebooks", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=200, help="requests per path and mode")
+    args = parser.parse_args()
+
+    app = create_app({
+        "DATABASE_PATH": os.path.join(tempfile.mkdtemp(), "bench.db"),
+        "CACHE_REDIS_HOST": None,
+        "CACHE_REDIS_URL": None,
+        "JWT_SECRET_KEY": "bench",
+        "SCHEDULER_ENABLED": False,
+    })
+    conn = get_db_connection()
+    datagen.generate(conn, users=args.users, ebooks=args.ebooks, requests=args.ebooks, feedback=0, content_kb=1)
+    conn.close()
+
+    client = app.test_client()
+    token = client.post("/login-user", json={"username": "user1", "password": datagen.PASSWORD}).json["token"]
+
+    if compression.brotli is None:
+        print("brotli is not installed, only gzip is compared")
+    print(f"{'path':<20}{'mode':<16}{'cpu ms/req':>12}{'wall ms/req':>13}{'bytes':>10}")
+    for path in PATHS:
+        for label, encoding, precompressed in modes():
+            compression.COMPRESS_CACHED = precompressed
+            with app.app_context():
+                cache.clear()
+            headers = {"Accept-Encoding": encoding, "Authorization": f"Bearer {token}"}
+            cpu, wall, size = measure(client, path, headers, args.requests)
+            print(f"{path:<20}{label:<16}{cpu:>12.3f}{wall:>13.3f}{size:>10}")
@@ -0,0 +1,126 @@
+# Before/after timings for the hot queries, with the schema at version 1
+# (tables only) and after every migration has been applied.
+#
+#   python benchmarks/bench_indexes.py --users 20000 --ebooks 50000 --requests 500000
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import migrate  # noqa: E402
+
+STATUSES = ["requested", "granted", "returned", "expired", "rejected"]
+
+QUERIES = [
+    ("login lookup", "SELECT * FROM users WHERE username = ?", lambda a: (f"user{random.randrange(a.users)}",)),
+    ("latest status", """
+        SELECT status FROM ebook_requests
+        WHERE user_id = ? AND ebook_id = ?
+        ORDER BY id DESC
+        LIMIT 1
+    """, lambda a: (random.randrange(1, a.users), random.randrange(1, a.ebooks))),
+    ("open request count", """
+        SELECT COUNT(*) FROM ebook_requests
+        WHERE user_id = ? AND status = 'requested'
+    """, lambda a: (random.randrange(1, a.users),)),
+    ("overdue requests", """
+        SELECT * FROM ebook_requests
+        WHERE status = 'granted' AND return_date < DATE('now')
+    """, lambda a: ()),
+    ("user borrowing history", """
+        SELECT ebooks.name, ebook_requests.request_date, ebook_requests.return_date
+        FROM ebooks
+        JOIN ebook_requests ON ebooks.id = ebook_requests.ebook_id
+        WHERE ebook_requests.user_id = ?
+    """, lambda a: (random.randrange(1, a.users),)),
+    ("user feedback", """
+        SELECT ebooks.*
+        FROM ebooks
+        JOIN feedback ON ebooks.id = feedback.ebook_id
+        WHERE feedback.user_id = ?
+    """, lambda a: (random.randrange(1, a.users),)),
+    ("ebooks by section", "SELECT * FROM ebooks WHERE section_id = ?", lambda a: (random.randrange(1, a.sections),)),
+]
+
+
+def seed(conn, args):
+    rng = random.Random(42)
+    today = date.today()
+    conn.executemany(
+        "INSERT INTO users (username, password, role) VALUES (?, ?, 'user')",
+        ((f"user{i}", "x") for i in range(args.users)),
+    )
+    conn.executemany(
+        "INSERT INTO sections (name, description) VALUES (?, ?)",
+        ((f"Section {i}", "description") for i in range(args.sections)),
+    )
+    conn.executemany(
+        "INSERT INTO ebooks (section_id, name, content, author, date_issued) VALUES (?, ?, ?, ?, ?)",
+        (
+            (rng.randrange(1, args.sections + 1), f"Ebook {i}", "x" * 200, f"Author {i % 997}",
+             (today - timedelta(days=rng.randrange(3650))).isoformat())
+            for i in range(args.ebooks)
+        ),
+    )
+    conn.executemany(
+        "INSERT INTO ebook_requests (user_id, ebook_id, request_date, return_date, status) VALUES (?, ?, ?, ?, ?)",
+        (
+            (rng.randrange(1, args.users + 1), rng.randrange(1, args.ebooks + 1),
+             (today - timedelta(days=rng.randrange(365))).isoformat(),
+             (today + timedelta(days=rng.randrange(-60, 30))).isoformat(), rng.choice(STATUSES))
+            for _ in range(args.requests)
+        ),
+    )
+    conn.executemany(
+        "INSERT INTO feedback (user_id, ebook_id, feedback, feedback_date) VALUES (?, ?, ?, ?)",
+        (
+            (rng.randrange(1, args.users + 1), rng.randrange(1, args.ebooks + 1), "great read", today.isoformat())
+            for _ in range(args.feedback)
+        ),
+    )
+    conn.commit()
+
+
+def run(conn, args):
+    results = {}
+    for name, sql, params in QUERIES:
+        random.seed(7)
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            conn.execute(sql, params(args)).fetchall()
+        results[name] = (time.perf_counter() - started) * 1000 / args.iterations
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the hot queries before and after migrations")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--sections", type=int, default=50)
+    parser.add_argument("--ebooks", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=200000)
+    parser.add_argument("--feedback", type=int, default=50000)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    conn = sqlite3.connect(path)
+    migrate(conn, target=1)
+    seed(conn, args)
+
+    before = run(conn, args)
+    started = time.perf_counter()
+    migrate(conn)
+    migration_ms = (time.perf_counter() - started) * 1000
+    after = run(conn, args)
+    conn.close()
+
+    print(f"{'query':<26}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for name in before:
+        print(f"{name:<26}{before[name]:>12.3f}{after[name]:>12.3f}{before[name] / after[name]:>9.1f}x")
+    print(f"Migrations took {migration_ms:.0f} ms")
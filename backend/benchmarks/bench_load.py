@@ -0,0 +1,257 @@
+# Load test of the API's endpoints with concurrent clients, reads, streamed
+# dumps, writes and bulk imports. Reports p50, p95 and p99 latency and
+# throughput per endpoint, and compares them with a saved baseline.
+#
+# By default a synthetic dataset (see datagen.py) is generated into a
+# temporary database and driven through the Flask test client. With --url
+# the same scenarios run over HTTP against a running server, whose
+# database should have been filled by datagen.py beforehand.
+#
+#   python benchmarks/bench_load.py --save-baseline benchmarks/baseline.json
+#   python benchmarks/bench_load.py --baseline benchmarks/baseline.json
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import datagen  # noqa: E402
+from app import create_app  # noqa: E402
+from db import get_db_connection  # noqa: E402
+
+
+IMPORT_ROWS = 50
+
+
+# NDJSON body for the bulk import scenarios
+def ndjson(records):
+    return b"".join(json.dumps(record).encode() + b"\n" for record in records)
+
+
+def ebook_body(ctx, rng):
+    return {
+        "section_id": rng.choice(ctx["sections"]),
+        "name": f"Load test {rng.randrange(10**6)}",
+        "author": rng.choice(datagen.WORDS).title(),
+        "content": " ".join(rng.choices(datagen.WORDS, k=500)),
+        "date_issued": "2024-01-01",
+    }
+
+
+# (name, method, path(ctx, rng), role, body(ctx, rng)). role picks the
+# bearer token sent, None for anonymous endpoints. A body is sent as JSON,
+# or as NDJSON if it is bytes. Write scenarios come last so the reads run
+# on the generated data only.
+SCENARIOS = [
+    ("ebooks_page", "GET", lambda ctx, rng: "/ebooks?limit=50", None, None),
+    ("ebooks_by_section", "GET", lambda ctx, rng: f"/ebooks?limit=50&section_id={rng.choice(ctx['sections'])}", None, None),
+    ("ebook", "GET", lambda ctx, rng: f"/ebooks/{rng.choice(ctx['ebooks'])}", None, None),
+    ("ebook_content_range", "GET", lambda ctx, rng: f"/ebooks/{rng.choice(ctx['ebooks'])}/content?page=1", None, None),
+    ("ebooks_requested", "GET", lambda ctx, rng: "/ebooks/requests", "user", None),
+    ("ebooks_feedback", "GET", lambda ctx, rng: f"/ebooks/feedback/{ctx['user_id']}", None, None),
+    ("search", "GET", lambda ctx, rng: f"/ebooks/search?q={rng.choice(datagen.WORDS[-30:])}", None, None),
+    ("sections", "GET", lambda ctx, rng: "/sections", None, None),
+    ("section", "GET", lambda ctx, rng: f"/sections/{rng.choice(ctx['sections'])}", None, None),
+    ("requests_user", "GET", lambda ctx, rng: "/ebook_requests_user", "user", None),
+    ("stats_user", "GET", lambda ctx, rng: "/stats/user", "user", None),
+    ("stats_librarian", "GET", lambda ctx, rng: "/stats/librarian?limit=50", "librarian", None),
+    ("requests_dump", "GET", lambda ctx, rng: "/ebook_requests?stream=ndjson", None, None),
+    ("feedback_dump", "GET", lambda ctx, rng: "/feedback?stream=ndjson", None, None),
+    ("feedback_create", "POST", lambda ctx, rng: "/feedback", None,
+     lambda ctx, rng: {"user_id": ctx["user_id"], "ebook_id": rng.choice(ctx["ebooks"]), "feedback": "Load test"}),
+    ("login", "POST", lambda ctx, rng: "/login-user", None,
+     lambda ctx, rng: {"username": ctx["username"], "password": datagen.PASSWORD}),
+    ("ebook_create", "POST", lambda ctx, rng: "/ebooks", "librarian", ebook_body),
+    ("ebook_update", "PUT", lambda ctx, rng: f"/ebooks/{rng.choice(ctx['ebooks'])}", "librarian", ebook_body),
+    ("section_create", "POST", lambda ctx, rng: "/sections", "librarian",
+     lambda ctx, rng: {"name": f"Load test {rng.randrange(10**6)}", "description": "Load test"}),
+    ("section_update", "PUT", lambda ctx, rng: f"/sections/{rng.choice(ctx['sections'])}", "librarian",
+     lambda ctx, rng: {"name": f"Load test {rng.randrange(10**6)}", "description": "Load test"}),
+    ("request_create", "POST", lambda ctx, rng: "/ebook_requests", "user",
+     lambda ctx, rng: {"user_id": rng.choice(ctx["users"]), "ebook_id": rng.choice(ctx["ebooks"]),
+                       "return_date": "2099-01-01"}),
+    ("request_update", "PUT", lambda ctx, rng: f"/ebook_requests/{rng.choice(ctx['requests'])}", None,
+     lambda ctx, rng: {"status": rng.choice(("granted", "returned"))}),
+    ("ebooks_import", "POST", lambda ctx, rng: "/ebooks/import", "librarian",
+     lambda ctx, rng: ndjson(ebook_body(ctx, rng) for _ in range(IMPORT_ROWS))),
+    ("sections_import", "POST", lambda ctx, rng: "/sections/import", "librarian",
+     lambda ctx, rng: ndjson({"name": f"Load test {i}", "description": "Load test"} for i in range(IMPORT_ROWS))),
+]
+
+
+# send(method, path, headers, body) -> (status, body bytes) for each target
+def test_client_sender(app):
+    local = threading.local()
+
+    def send(method, path, headers, body):
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+        if isinstance(body, bytes):
+            response = local.client.open(path, method=method, headers=headers, data=body,
+                                         content_type="application/x-ndjson")
+        else:
+            response = local.client.open(path, method=method, headers=headers, json=body)
+        return response.status_code, response.get_data()
+
+    return send
+
+
+def http_sender(base_url):
+    def send(method, path, headers, body):
+        data = body if body is None or isinstance(body, bytes) else json.dumps(body).encode()
+        request = urllib.request.Request(base_url + path, data=data, method=method, headers=headers)
+        if data is not None:
+            request.add_header("Content-Type", "application/x-ndjson" if data is body else "application/json")
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.read()
+
+    return send
+
+
+# Log in and collect the ids the scenarios pick from
+def discover(send, username):
+    ctx = {"username": username, "tokens": {}}
+    for role, path, login in (
+        ("user", "/login-user", {"username": username, "password": datagen.PASSWORD}),
+        ("librarian", "/login-librarian", {"username": "librarian", "password": "librarian"}),
+    ):
+        status, body = send("POST", path, {}, login)
+        if status != 200:
+            raise SystemExit(f"Logging in as {login['username']} failed with {status}")
+        data = json.loads(body)
+        ctx["tokens"][role] = data["token"]
+        if role == "user":
+            ctx["user_id"] = data["user"]["id"]
+    ctx["sections"] = [section["id"] for section in json.loads(send("GET", "/sections", {}, None)[1])]
+    ctx["ebooks"] = [ebook["id"] for ebook in json.loads(send("GET", "/ebooks?fields=id&limit=1000", {}, None)[1])]
+    # Requests are spread over the users who left feedback, so the open
+    # request limit of a single user isn't hit at once
+    feedback = json.loads(send("GET", "/feedback", {}, None)[1])
+    ctx["users"] = sorted({entry["user_id"] for entry in feedback}) or [ctx["user_id"]]
+    headers = {"Authorization": f"Bearer {ctx['tokens']['user']}"}
+    requests = json.loads(send("GET", "/ebook_requests_user", headers, None)[1])
+    ctx["requests"] = [entry["id"] for entry in requests] or [0]
+    return ctx
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] if samples else float("nan")
+
+
+def run_scenario(send, ctx, scenario, requests, clients, seed):
+    name, method, path, role, body = scenario
+    headers = {"Authorization": f"Bearer {ctx['tokens'][role]}"} if role else {}
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def worker(index):
+        rng = random.Random(f"{seed}:{name}:{index}")
+        local, failed = [], 0
+        for _ in range(requests // clients):
+            started = time.perf_counter()
+            status, _ = send(method, path(ctx, rng), headers, body(ctx, rng) if body else None)
+            local.append((time.perf_counter() - started) * 1000)
+            failed += status >= 400
+        with lock:
+            latencies.extend(local)
+            errors.append(failed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors),
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "rps": round(len(latencies) / elapsed, 1),
+    }
+
+
+# Endpoints whose p95 grew or throughput dropped by more than the tolerance
+def regressions(results, baseline, tolerance):
+    found = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            found.append(f"{name}: p95 {base['p95_ms']:.1f} -> {result['p95_ms']:.1f} ms")
+        if result["rps"] < base["rps"] * (1 - tolerance):
+            found.append(f"{name}: throughput {base['rps']:.1f} -> {result['rps']:.1f} req/s")
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the API endpoints")
+    parser.add_argument("--url", help="base URL of a running server instead of the test client")
+    parser.add_argument("--username", default="user1", help="generated user to log in as")
+    parser.add_argument("--requests", type=int, default=400, help="requests per endpoint")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--only", help="comma separated scenario names")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--ebooks", type=int, default=10000)
+    parser.add_argument("--ebook-requests", type=int, default=100000)
+    parser.add_argument("--feedback", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", help="fail if results regress against this file")
+    parser.add_argument("--save-baseline", help="write the results to this file")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    if args.url:
+        send = http_sender(args.url.rstrip("/"))
+    else:
+        app = create_app({
+            "DATABASE_PATH": os.path.join(tempfile.mkdtemp(), "bench.db"),
+            "CACHE_REDIS_HOST": None,
+            "CACHE_REDIS_URL": None,
+            "JWT_SECRET_KEY": "bench",
+            "SCHEDULER_ENABLED": False,
+        })
+        conn = get_db_connection()
+        datagen.generate(conn, users=args.users, ebooks=args.ebooks, requests=args.ebook_requests,
+                         feedback=args.feedback, seed=args.seed)
+        conn.close()
+        send = test_client_sender(app)
+
+    ctx = discover(send, args.username)
+    scenarios = SCENARIOS
+    if args.only:
+        names = set(args.only.split(","))
+        scenarios = [scenario for scenario in SCENARIOS if scenario[0] in names]
+
+    results = {}
+    print(f"{'endpoint':<22}{'requests':>10}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+    for scenario in scenarios:
+        result = run_scenario(send, ctx, scenario, args.requests, args.clients, args.seed)
+        results[scenario[0]] = result
+        print(f"{scenario[0]:<22}{result['requests']:>10}{result['errors']:>8}{result['p50_ms']:>10.2f}"
+              f"{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}{result['rps']:>10.1f}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as file:
+            found = regressions(results, json.load(file), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        sys.exit(1 if found else 0)
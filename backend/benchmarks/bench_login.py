@@ -0,0 +1,96 @@
+# Login throughput during a burst, and how much the burst slows down an
+# unrelated cheap endpoint. Hash parameters and pool limits come from the
+# usual environment variables (PASSWORD_HASH_METHOD, HASH_WORKERS, ...).
+#
+#   python benchmarks/bench_login.py --clients 32 --seconds 10
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from flask_jwt_extended import JWTManager  # noqa: E402
+from cache import cache  # noqa: E402
+from db import get_db_connection, init_db, pool  # noqa: E402
+from passwords import hash_password, hash_pool  # noqa: E402
+from users import users_bp  # noqa: E402
+
+
+def seed(count):
+    hashed = hash_password("password")
+    conn = get_db_connection()
+    conn.executemany(
+        "INSERT INTO users (username, password, role) VALUES (?, ?, 'user')",
+        ((f"user{i}", hashed) for i in range(count)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return float("nan")
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def login_client(app, users, deadline, results, index):
+    client = app.test_client()
+    i = index
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = client.post("/login-user", json={"username": f"user{i % users}", "password": "password"})
+        results.append((response.status_code, (time.perf_counter() - started) * 1000))
+        i += 1
+
+
+def ping_client(app, deadline, latencies):
+    client = app.test_client()
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        client.get("/ping")
+        latencies.append((time.perf_counter() - started) * 1000)
+        time.sleep(0.01)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark login throughput under a burst")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    pool.configure(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    init_db()
+    seed(args.users)
+
+    app = Flask(__name__)
+    app.config["CACHE_TYPE"] = "NullCache"
+    app.config["JWT_SECRET_KEY"] = "bench"
+    cache.init_app(app)
+    pool.init_app(app)
+    JWTManager(app)
+    app.register_blueprint(users_bp)
+    app.add_url_rule("/ping", "ping", lambda: "pong")
+
+    results, pings = [], []
+    deadline = time.perf_counter() + args.seconds
+    threads = [threading.Thread(target=login_client, args=(app, args.users, deadline, results, i)) for i in range(args.clients)]
+    threads.append(threading.Thread(target=ping_client, args=(app, deadline, pings)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ok = [ms for status, ms in results if status == 200]
+    busy = sum(1 for status, _ in results if status == 503)
+    print(f"hash method     {hash_pool.stats()['method']}  workers={hash_pool.workers}")
+    print(f"logins/s        {len(ok) / args.seconds:10.1f}")
+    print(f"login p50/p95   {statistics.median(ok) if ok else float('nan'):10.1f} {percentile(ok, 0.95):10.1f} ms")
+    print(f"rejected (503)  {busy:10d}")
+    print(f"ping p50/p99    {statistics.median(pings) if pings else float('nan'):10.1f} {percentile(pings, 0.99):10.1f} ms")
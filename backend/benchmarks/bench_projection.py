@@ -0,0 +1,73 @@
+# Response size and time of GET /ebooks with the summary projection versus
+# the full rows (fields=...,content), on a catalog with book-sized content.
+#
+#   python benchmarks/bench_projection.py --ebooks 2000 --content-kb 200
+import argparse
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from cache import cache  # noqa: E402
+from content_store import write_content  # noqa: E402
+from db import get_db_connection, init_db, pool  # noqa: E402
+from ebooks import ebooks_bp, EBOOK_FIELDS  # noqa: E402
+
+
+def seed(args):
+    rng = random.Random(42)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(5000)]
+    conn = get_db_connection()
+    conn.execute("INSERT INTO sections (name, description) VALUES ('Bench', 'Benchmark section')")
+    for start in range(0, args.ebooks, 100):
+        for i in range(start, min(start + 100, args.ebooks)):
+            size = int(args.content_kb * 1024 * rng.uniform(0.5, 1.5))
+            content = " ".join(rng.choices(words, k=size // 6))[:size]
+            cursor = conn.execute(
+                "INSERT INTO ebooks (section_id, name, content, author, date_issued) VALUES (1, ?, '', ?, ?)",
+                (f"Ebook {i}", f"Author {i % 97}", "2024-01-01"),
+            )
+            write_content(conn, cursor.lastrowid, content)
+        conn.commit()
+    conn.close()
+
+
+def measure(client, url, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        response = client.get(url)
+        body = response.get_data()
+    elapsed = (time.perf_counter() - started) * 1000 / iterations
+    return len(body), elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the ebook listing projection")
+    parser.add_argument("--ebooks", type=int, default=1000)
+    parser.add_argument("--content-kb", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=5)
+    args = parser.parse_args()
+
+    pool.configure(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    init_db()
+    seed(args)
+
+    app = Flask(__name__)
+    app.config["CACHE_TYPE"] = "NullCache"
+    cache.init_app(app)
+    pool.init_app(app)
+    app.register_blueprint(ebooks_bp)
+    client = app.test_client()
+
+    full_bytes, full_ms = measure(client, "/ebooks?fields=" + ",".join(EBOOK_FIELDS), args.iterations)
+    summary_bytes, summary_ms = measure(client, "/ebooks", args.iterations)
+
+    print(f"{'projection':<12}{'bytes':>16}{'ms':>12}")
+    print(f"{'full':<12}{full_bytes:>16,}{full_ms:>12.1f}")
+    print(f"{'summary':<12}{summary_bytes:>16,}{summary_ms:>12.1f}")
+    print(f"Saved {1 - summary_bytes / full_bytes:.1%} of the bytes and {1 - summary_ms / full_ms:.1%} of the time")
@@ -0,0 +1,73 @@
+# Latency of GET /ebooks/search at several catalog sizes.
+#
+#   python benchmarks/bench_search.py --sizes 10000 100000 --content-kb 2
+import argparse
+import os
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from content_store import write_content  # noqa: E402
+from db import get_db_connection, init_db, pool  # noqa: E402
+from search import search_bp  # noqa: E402
+from search_index import rebuild_search_index  # noqa: E402
+
+QUERIES = ["common", "rare", "common rare", "pre", "author 42", "zzzz"]
+
+
+def seed(size, content_kb):
+    rng = random.Random(42)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(20000)]
+    conn = get_db_connection()
+    conn.execute("INSERT INTO sections (name, description) VALUES ('Bench', 'Benchmark section')")
+    for i in range(size):
+        text = " ".join(rng.choices(words, k=content_kb * 1024 // 6))
+        # A few words with known frequencies
+        if i % 10 == 0:
+            text += " common"
+        if i % 1000 == 0:
+            text += " rare"
+        cursor = conn.execute(
+            "INSERT INTO ebooks (section_id, name, content, author, date_issued) VALUES (1, ?, '', ?, '2024-01-01')",
+            (f"Ebook {i} {rng.choice(words)}", f"Author {i % 500}"),
+        )
+        write_content(conn, cursor.lastrowid, text, index=False)
+        if i % 1000 == 999:
+            conn.commit()
+    rebuild_search_index(conn)
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark full-text search latency")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--content-kb", type=int, default=2)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.register_blueprint(search_bp)
+    client = app.test_client()
+
+    for size in args.sizes:
+        pool.configure(os.path.join(tempfile.mkdtemp(), "bench.db"))
+        init_db()
+        started = time.perf_counter()
+        seed(size, args.content_kb)
+        print(f"Seeded and indexed {size} ebooks in {time.perf_counter() - started:.1f} s")
+        print(f"{'ebooks':>8}  {'query':<14}{'p50 ms':>10}{'p95 ms':>10}")
+        for query in QUERIES:
+            timings = []
+            for _ in range(args.iterations):
+                started = time.perf_counter()
+                client.get("/ebooks/search", query_string={"q": query})
+                timings.append((time.perf_counter() - started) * 1000)
+            p95 = statistics.quantiles(timings, n=20)[-1]
+            print(f"{size:>8}  {query:<14}{statistics.median(timings):>10.2f}{p95:>10.2f}")
@@ -0,0 +1,86 @@
+# Time and payload size of the row serializers on generated data: the old
+# sqlite3.Row -> dict -> jsonify path against tuples written with orjson as
+# objects, as the columnar layout, and as MessagePack when it is installed.
+#
+#   python benchmarks/bench_serialization.py --requests 200000
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import datagen  # noqa: E402
+from app import create_app  # noqa: E402
+from db import get_db_connection  # noqa: E402
+from flask import jsonify  # noqa: E402
+from serializers import fetch_rows, msgpack, rows_response  # noqa: E402
+
+QUERIES = {
+    "ebooks": "SELECT id, section_id, name, author, date_issued FROM ebooks",
+    "ebook_requests": "SELECT * FROM ebook_requests",
+    "feedback": "SELECT * FROM feedback",
+}
+
+
+def legacy(conn, query):
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    cursor.execute(query)
+    return jsonify([dict(row) for row in cursor.fetchall()])
+
+
+def encoders():
+    found = {
+        "row+jsonify": legacy,
+        "orjson": lambda conn, query: rows_response(*fetch_rows(conn, query), "json"),
+        "columnar": lambda conn, query: rows_response(*fetch_rows(conn, query), "columnar"),
+    }
+    if msgpack is not None:
+        found["msgpack"] = lambda conn, query: rows_response(*fetch_rows(conn, query), "msgpack")
+    return found
+
+
+# Best of `repeat` runs, so the numbers aren't skewed by a cold page cache
+def measure(conn, encode, query, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = encode(conn, query).get_data()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, len(body)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare row serializers")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--ebooks", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--feedback", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app({
+        "DATABASE_PATH": os.path.join(tempfile.mkdtemp(), "bench.db"),
+        "CACHE_REDIS_HOST": None,
+        "CACHE_REDIS_URL": None,
+        "SCHEDULER_ENABLED": False,
+    })
+    conn = get_db_connection()
+    datagen.generate(conn, users=args.users, ebooks=args.ebooks, requests=args.requests,
+                     feedback=args.feedback, content_kb=1)
+
+    if msgpack is None:
+        print("msgpack is not installed, skipping it")
+    print(f"{'query':<16}{'encoder':<14}{'rows':>9}{'ms':>10}{'KiB':>10}{'speedup':>9}")
+    with app.app_context():
+        for name, query in QUERIES.items():
+            rows = conn.execute(f"SELECT COUNT(*) FROM ({query})").fetchone()[0]
+            baseline = None
+            for label, encode in encoders().items():
+                ms, size = measure(conn, encode, query, args.repeat)
+                baseline = baseline or ms
+                print(f"{name:<16}{label:<14}{rows:>9}{ms:>10.1f}{size / 1024:>10.0f}{baseline / ms:>8.1f}x")
+    conn.close()
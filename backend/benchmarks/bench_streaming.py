@@ -0,0 +1,77 @@
+# Peak memory and time to first byte of GET /ebook_requests, buffered versus
+# streamed as NDJSON, on a large ebook_requests table.
+#
+#   python benchmarks/bench_streaming.py --requests 1000000
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from cache import cache  # noqa: E402
+from db import get_db_connection, init_db, pool  # noqa: E402
+from ebook_requests import ebook_requests_bp  # noqa: E402
+
+STATUSES = ["requested", "granted", "returned", "expired", "rejected"]
+
+
+def seed(count):
+    rng = random.Random(42)
+    today = date.today()
+    conn = get_db_connection()
+    for start in range(0, count, 50000):
+        conn.executemany(
+            "INSERT INTO ebook_requests (user_id, ebook_id, request_date, return_date, status) VALUES (?, ?, ?, ?, ?)",
+            (
+                (rng.randrange(1, 5000), rng.randrange(1, 20000),
+                 (today - timedelta(days=rng.randrange(365))).isoformat(),
+                 (today + timedelta(days=rng.randrange(-60, 30))).isoformat(), rng.choice(STATUSES))
+                for _ in range(min(50000, count - start))
+            ),
+        )
+        conn.commit()
+    conn.close()
+
+
+def measure(client, url):
+    tracemalloc.start()
+    started = time.perf_counter()
+    response = client.get(url, buffered=False)
+    chunks = iter(response.response)
+    size = len(next(chunks))
+    first_byte = (time.perf_counter() - started) * 1000
+    for chunk in chunks:
+        size += len(chunk)
+    total = (time.perf_counter() - started) * 1000
+    response.close()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return first_byte, total, peak, size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark streamed versus buffered dumps")
+    parser.add_argument("--requests", type=int, default=1000000)
+    args = parser.parse_args()
+
+    pool.configure(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    init_db()
+    seed(args.requests)
+
+    app = Flask(__name__)
+    app.config["CACHE_TYPE"] = "NullCache"
+    cache.init_app(app)
+    pool.init_app(app)
+    app.register_blueprint(ebook_requests_bp)
+    client = app.test_client()
+
+    print(f"{'mode':<10}{'first byte ms':>15}{'total ms':>12}{'peak MiB':>12}{'bytes':>16}")
+    for mode, url in (("buffered", "/ebook_requests"), ("ndjson", "/ebook_requests?stream=ndjson"), ("json", "/ebook_requests?stream=json")):
+        first_byte, total, peak, size = measure(client, url)
+        print(f"{mode:<10}{first_byte:>15.1f}{total:>12.1f}{peak / 2**20:>12.1f}{size:>16,}")
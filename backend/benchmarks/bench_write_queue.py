@@ -0,0 +1,96 @@
+# Throughput of POST /feedback with one commit per request against the
+# group-commit write queue, acknowledging durably or once queued. Use
+# --synchronous FULL to see the cost of an fsync per commit.
+#
+#   python benchmarks/bench_write_queue.py --clients 16 --seconds 10 --synchronous FULL
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] if samples else float("nan")
+
+
+# (label, app config)
+MODES = [
+    ("per-request commit", {"WRITE_QUEUE_ENABLED": False}),
+    ("group commit, durable", {"WRITE_QUEUE_ENABLED": True, "WRITE_QUEUE_ACK": "durable"}),
+    ("group commit, queued", {"WRITE_QUEUE_ENABLED": True, "WRITE_QUEUE_ACK": "queued"}),
+]
+
+
+def run(config, clients, seconds):
+    app = create_app({
+        "DATABASE_PATH": os.path.join(tempfile.mkdtemp(), "bench.db"),
+        "CACHE_REDIS_HOST": None,
+        "CACHE_REDIS_URL": None,
+        "SCHEDULER_ENABLED": False,
+        **config,
+    })
+    conn = get_db_connection()
+    datagen.generate(conn, users=100, ebooks=100, requests=0, feedback=0, content_kb=1)
+    conn.close()
+
+    write_queue.counters.update(dict.fromkeys(write_queue.counters, 0))
+    deadline = time.monotonic() + seconds
+    statuses = Counter()
+    latencies = []
+    lock = threading.Lock()
+
+    def client_loop(index):
+        client = app.test_client()
+        local, seen = [], Counter()
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            response = client.post("/feedback", json={
+                "user_id": index % 100 + 1, "ebook_id": len(local) % 100 + 1, "feedback": "Load test",
+            })
+            local.append((time.perf_counter() - started) * 1000)
+            seen[response.status_code] += 1
+        with lock:
+            latencies.extend(local)
+            statuses.update(seen)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client_loop, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Queued writes count once they are committed
+    write_queue.stop()
+    elapsed = time.perf_counter() - started
+
+    conn = get_db_connection()
+    committed = conn.execute("SELECT COUNT(*) FROM feedback").fetchone()[0]
+    conn.close()
+    latencies.sort()
+    return committed, elapsed, statuses, latencies, write_queue.stats()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-request commits with the group-commit write queue")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--synchronous", default="NORMAL", help="PRAGMA synchronous for the run (NORMAL or FULL)")
+    args = parser.parse_args()
+
+    # Read by db.py when it is imported
+    os.environ["DB_SYNCHRONOUS"] = args.synchronous
+    import datagen  # noqa: E402
+    from app import create_app  # noqa: E402
+    from db import get_db_connection  # noqa: E402
+    from write_queue import write_queue  # noqa: E402
+
+    print(f"{'mode':<24}{'rows/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'batches':>9}{'largest':>9}  statuses")
+    for label, config in MODES:
+        committed, elapsed, statuses, latencies, stats = run(config, args.clients, args.seconds)
+        print(f"{label:<24}{committed / elapsed:>10.1f}{percentile(latencies, 0.5):>10.2f}"
+              f"{percentile(latencies, 0.99):>10.2f}{stats['batches']:>9}{stats['largest_batch']:>9}  {dict(statuses)}")
@@ -1,3 +1,73 @@
+import hashlib
+import time
+from flask import request
 from flask_caching import Cache
+from compression import precompress
 
-cache = Cache() 
\ No newline at end of file
+cache = Cache()
+
+
+# Listings are cached under keys built from their query parameters, so a
+# single delete can't reach every variant. Instead each key embeds a
+# generation number and writers bump it, orphaning the old entries.
+#
+# Generations also version resources for ETags (see etags.py). A missing
+# counter starts from the current time in milliseconds rather than 0, so
+# one that was evicted never repeats a value a client may still hold.
+def get_generation(name):
+    key = f"{name}:generation"
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, int(time.time() * 1000), timeout=0)
+        generation = cache.get(key) or 0
+    return generation
+
+
+def bump_generation(name):
+    get_generation(name)
+    cache.cache.inc(f"{name}:generation")
+    cache.set(f"{name}:modified", time.time(), timeout=0)
+
+
+# Time of the last bump, None if unknown
+def get_modified(name):
+    return cache.get(f"{name}:modified")
+
+
+# Cache entries are tagged with the data they were built from: a table
+# ("table:ebooks"), a row ("ebook:42", "section:3") or everything belonging
+# to a user ("user:7"). Each tag is a generation counter embedded in the
+# entry's key, so invalidating a tag orphans every dependent entry at once.
+def invalidate(*tags):
+    for tag in dict.fromkeys(tags):
+        bump_generation(tag)
+
+
+# Key for an entry depending on tags; params tells variants apart
+def tagged_key(prefix, tags, params=""):
+    versions = ",".join(f"{tag}={get_generation(tag)}" for tag in tags)
+    digest = hashlib.sha1(versions.encode()).hexdigest()
+    return f"{prefix}:{digest}:{params}"
+
+
+# Only successful responses are cached; errors are returned as tuples
+def is_cacheable(rv):
+    return not isinstance(rv, tuple) and getattr(rv, "status_code", 200) == 200
+
+
+# Cache a view under its path and tags. tags(**view_args) names what the
+# response depends on, params() the request variant (the sorted query
+# string by default). Large responses are cached with their compressed
+# encodings (see compression.py).
+def cached_by_tags(tags, timeout=60, params=None):
+    def make_key(*args, **kwargs):
+        variant = params() if params else "&".join(
+            f"{key}={value}" for key, value in sorted(request.args.items(multi=True))
+        )
+        return tagged_key(f"view:{request.path}", tags(**kwargs), variant)
+
+    def decorator(view):
+        cached = cache.cached(timeout=timeout, make_cache_key=make_key, response_filter=is_cacheable)
+        return cached(precompress(view))
+
+    return decorator
@@ -0,0 +1,171 @@
+import argparse
+import os
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import get_jwt_identity, jwt_required
+from db import get_db_connection
+from users import is_librarian
+
+changes_bp = Blueprint("changes", __name__)
+
+# Change log entries older than this are dropped; clients that last synced
+# before then have to reload. Superseded entries (an older change to a row
+# that changed again later) are compacted away when CHANGES_COMPACT is on.
+CHANGES_RETENTION_DAYS = float(os.getenv("CHANGES_RETENTION_DAYS") or 30)
+CHANGES_COMPACT = os.getenv("CHANGES_COMPACT", "1") == "1"
+CHANGES_MAINTENANCE_INTERVAL_SECONDS = int(os.getenv("CHANGES_MAINTENANCE_INTERVAL_SECONDS") or 3600)
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+# Current state of a changed row, per entity
+ENTITY_QUERIES = {
+    "ebook": "SELECT id, section_id, name, author, date_issued FROM ebooks WHERE id IN ({})",
+    "section": "SELECT * FROM sections WHERE id IN ({})",
+    "ebook_request": "SELECT * FROM ebook_requests WHERE id IN ({})",
+    "feedback": "SELECT * FROM feedback WHERE id IN ({})",
+}
+
+
+def latest_cursor(conn):
+    return conn.execute("SELECT COALESCE(MAX(id), 0) FROM changes").fetchone()[0]
+
+
+def pruned_through(conn):
+    return conn.execute("SELECT pruned_through FROM changes_horizon").fetchone()[0]
+
+
+# Current rows of the changed entities as {(entity, id): dict}
+def load_rows(conn, keys):
+    ids = {}
+    for entity, entity_id in keys:
+        ids.setdefault(entity, []).append(entity_id)
+    rows = {}
+    for entity, entity_ids in ids.items():
+        query = ENTITY_QUERIES[entity].format(",".join("?" * len(entity_ids)))
+        for row in conn.execute(query, entity_ids):
+            rows[(entity, row["id"])] = dict(row)
+    return rows
+
+
+# Drop log entries superseded by a later change to the same row. A client
+# at any cursor still sees the latest change, so compaction never loses an
+# update, only the intermediate ones.
+def compact_changes(conn):
+    deleted = conn.execute("""
+        DELETE FROM changes
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM changes GROUP BY entity, entity_id
+        )
+    """).rowcount
+    conn.commit()
+    return deleted
+
+
+# Drop entries older than the retention period and move the horizon past
+# them, so cursors from before it are refused instead of silently missing
+# changes
+def prune_changes(conn, retention_days=CHANGES_RETENTION_DAYS):
+    row = conn.execute(
+        "SELECT MAX(id) FROM changes WHERE changed_at < DATETIME('now', ?)",
+        (f"-{retention_days} days",),
+    ).fetchone()
+    if row[0] is None:
+        return 0
+    deleted = conn.execute("DELETE FROM changes WHERE id <= ?", (row[0],)).rowcount
+    conn.execute(
+        "UPDATE changes_horizon SET pruned_through = MAX(pruned_through, ?)", (row[0],)
+    )
+    conn.commit()
+    return deleted
+
+
+# Scheduled job: retention, then compaction. Returns the entries removed.
+def maintain_change_log():
+    conn = get_db_connection()
+    try:
+        removed = prune_changes(conn)
+        if CHANGES_COMPACT:
+            removed += compact_changes(conn)
+        return removed
+    finally:
+        conn.close()
+
+
+# Changes after a cursor, for clients keeping a local copy of what they can
+# see. Without ?since= only the current cursor is returned: take it, load
+# the full lists, then sync from it. Inserts and updates carry the row as it
+# is now and should be applied as upserts; deletes carry no data.
+@changes_bp.route("/changes", methods=["GET"])
+@jwt_required(optional=True)
+def get_changes():
+    current_user = get_jwt_identity()
+    since = request.args.get("since", type=int)
+    limit = min(request.args.get("limit", DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE)
+    if limit < 1 or (since is not None and since < 0):
+        return jsonify({"message": "Invalid cursor or limit!"}), 400
+
+    conn = get_db_connection()
+    if since is None:
+        cursor = latest_cursor(conn)
+        conn.close()
+        return jsonify({"changes": [], "cursor": cursor, "has_more": False})
+
+    if since < pruned_through(conn):
+        conn.close()
+        return jsonify({"message": "Cursor has expired, reload everything!"}), 410
+
+    # Catalog changes are public, requests and feedback only go to their
+    # owner and to librarians
+    if current_user and is_librarian(current_user):
+        visibility, params = "", ()
+    else:
+        visibility = "AND (user_id IS NULL OR user_id = ?)"
+        params = (current_user["id"] if current_user else None,)
+    entries = conn.execute(
+        f"""
+        SELECT id, entity, entity_id, op FROM changes
+        WHERE id > ? {visibility}
+        ORDER BY id
+        LIMIT ?
+    """,
+        (since, *params, limit + 1),
+    ).fetchall()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    # Only the last change to each row in the page matters
+    latest = {}
+    for entry in entries:
+        latest.pop((entry["entity"], entry["entity_id"]), None)
+        latest[(entry["entity"], entry["entity_id"])] = entry
+    rows = load_rows(conn, [key for key, entry in latest.items() if entry["op"] != "delete"])
+    conn.close()
+
+    changes = [
+        {
+            "cursor": entry["id"],
+            "entity": entry["entity"],
+            "id": entry["entity_id"],
+            "op": entry["op"],
+            "data": rows.get(key) if entry["op"] != "delete" else None,
+        }
+        for key, entry in latest.items()
+    ]
+    return jsonify({
+        "changes": changes,
+        "cursor": entries[-1]["id"] if entries else since,
+        "has_more": has_more,
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prune and compact the change log")
+    parser.add_argument("--retention-days", type=float, default=CHANGES_RETENTION_DAYS)
+    parser.add_argument("--no-compact", action="store_true", help="only apply retention")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    pruned = prune_changes(conn, args.retention_days)
+    compacted = 0 if args.no_compact else compact_changes(conn)
+    conn.close()
+    print(f"Pruned {pruned} and compacted {compacted} change log entries")
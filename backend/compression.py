@@ -0,0 +1,101 @@
+import gzip
+import os
+from functools import wraps
+from flask import request
+import metrics
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is used without it
+    brotli = None
+
+# Bodies smaller than this are sent as they are
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE") or 1024)
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL") or 6)
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY") or 5)
+# Compress cached views once, when they are cached, instead of per hit
+COMPRESS_CACHED = os.getenv("COMPRESS_CACHED", "1") == "1"
+
+COMPRESSIBLE_MIMETYPES = ("application/json", "application/msgpack", "text/plain", "text/html", "text/csv")
+
+# Supported encodings, preferred first when the client accepts several
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+compressed_responses = metrics.registry.register(metrics.Counter(
+    "http_compressed_responses_total", "Compressed responses by encoding and whether the body was precompressed",
+    ("encoding", "precompressed"),
+))
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    # mtime=0 keeps the output identical for identical bodies
+    return gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+
+def is_compressible(response):
+    return (
+        response.status_code == 200
+        and not response.is_streamed
+        and not response.direct_passthrough
+        and "Content-Encoding" not in response.headers
+        and response.mimetype in COMPRESSIBLE_MIMETYPES
+    )
+
+
+# The best encoding the client accepts, None for the identity encoding
+def negotiate_encoding():
+    accepted = request.accept_encodings
+    best, best_quality = None, 0
+    for encoding in ENCODINGS:
+        quality = accepted.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+# Store every encoding of a cacheable response on it, so the copies served
+# from the cache are compressed already. Wraps the view inside cache.cached.
+def precompress(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        rv = view(*args, **kwargs)
+        if COMPRESS_CACHED and not isinstance(rv, tuple) and is_compressible(rv):
+            data = rv.get_data()
+            if len(data) >= COMPRESS_MIN_SIZE:
+                rv.precompressed = {encoding: compress(data, encoding) for encoding in ENCODINGS}
+        return rv
+
+    return wrapper
+
+
+def _compress_response(response):
+    if not is_compressible(response):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+
+    stored = getattr(response, "precompressed", None) or {}
+    body = stored.get(encoding)
+    if body is None:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        body = compress(data, encoding)
+    compressed_responses.inc(encoding, str(encoding in stored).lower())
+
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    # The compressed body is a different representation of the same
+    # resource, so its ETag can only match weakly
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    app.after_request(_compress_response)
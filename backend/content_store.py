@@ -0,0 +1,135 @@
+import os
+import zlib
+
+# Ebook content lives outside the ebooks table, as zlib-compressed chunks of
+# CHUNK_SIZE bytes of UTF-8 text. Scans of ebooks never page through book
+# bodies, and a reader can fetch any byte range by decompressing only the
+# chunks that cover it.
+CHUNK_SIZE = 64 * 1024
+COMPRESSION_LEVEL = 6
+# Only the start of a book goes into the full-text index next to its name
+# and author; indexing whole books would keep a second, uncompressed copy
+# of every book in ebooks_fts.
+SEARCH_PREFIX_CHARS = int(os.getenv("SEARCH_PREFIX_CHARS") or 16384)
+
+
+# The part of a book's text that is indexed for search
+def search_text(text):
+    return text[:SEARCH_PREFIX_CHARS]
+
+
+# Split text into compressed chunk rows. Returns (size in bytes, rows) with
+# rows ready for INSERT INTO ebook_content_chunks.
+def compress_content(ebook_id, text):
+    data = text.encode("utf-8")
+    rows = [
+        (ebook_id, number, zlib.compress(data[start : start + CHUNK_SIZE], COMPRESSION_LEVEL))
+        for number, start in enumerate(range(0, len(data), CHUNK_SIZE))
+    ]
+    return len(data), rows
+
+
+# Replace the stored content of an ebook. Runs in the caller's transaction.
+# The full-text index is updated too unless index is False (migrations that
+# run before the index exists).
+def write_content(conn, ebook_id, text, index=True):
+    size, rows = compress_content(ebook_id, text)
+    conn.execute("DELETE FROM ebook_content_chunks WHERE ebook_id = ?", (ebook_id,))
+    conn.executemany(
+        "INSERT INTO ebook_content_chunks (ebook_id, chunk_no, data) VALUES (?, ?, ?)",
+        rows,
+    )
+    conn.execute(
+        "UPDATE ebooks SET content = '', content_size = ? WHERE id = ?",
+        (size, ebook_id),
+    )
+    if index:
+        conn.execute("UPDATE ebooks_fts SET content = ? WHERE rowid = ?", (search_text(text), ebook_id))
+    return size
+
+
+def delete_content(conn, ebook_id):
+    conn.execute("DELETE FROM ebook_content_chunks WHERE ebook_id = ?", (ebook_id,))
+
+
+# Size of the stored content in bytes, None if the ebook does not exist
+def content_size(conn, ebook_id):
+    row = conn.execute("SELECT content_size FROM ebooks WHERE id = ?", (ebook_id,)).fetchone()
+    return None if row is None else row[0]
+
+
+# Yield the bytes in [start, end] (inclusive), one chunk at a time
+def iter_content(conn, ebook_id, start=0, end=None):
+    if end is None:
+        end = content_size(conn, ebook_id) - 1
+    if end < start:
+        return
+    first, last = start // CHUNK_SIZE, end // CHUNK_SIZE
+    for number in range(first, last + 1):
+        row = conn.execute(
+            "SELECT data FROM ebook_content_chunks WHERE ebook_id = ? AND chunk_no = ?",
+            (ebook_id, number),
+        ).fetchone()
+        if row is None:
+            return
+        data = zlib.decompress(row[0])
+        offset = number * CHUNK_SIZE
+        yield data[max(start - offset, 0) : end - offset + 1]
+
+
+# First offset at or after offset that starts a UTF-8 character (or the end
+# of the content), so text cut there decodes on both sides
+def char_boundary(conn, ebook_id, offset, size):
+    if offset >= size:
+        return size
+    # A character is at most four bytes, so one of these starts one
+    head = b"".join(iter_content(conn, ebook_id, offset, min(offset + 3, size - 1)))
+    for skipped, byte in enumerate(head):
+        if byte & 0xC0 != 0x80:
+            return offset + skipped
+    return offset + len(head)
+
+
+# Whole content as text
+def read_content(conn, ebook_id):
+    return b"".join(iter_content(conn, ebook_id)).decode("utf-8")
+
+
+# Whole content of several ebooks at once, as a map of ebook_id -> text
+def read_contents(conn, ebook_ids, batch_size=500):
+    chunks = {ebook_id: [] for ebook_id in ebook_ids}
+    ids = list(chunks)
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start : start + batch_size]
+        placeholders = ", ".join("?" * len(batch))
+        rows = conn.execute(
+            f"""
+            SELECT ebook_id, data FROM ebook_content_chunks
+            WHERE ebook_id IN ({placeholders})
+            ORDER BY ebook_id, chunk_no
+            """,
+            batch,
+        )
+        for ebook_id, data in rows:
+            chunks[ebook_id].append(zlib.decompress(data))
+    return {ebook_id: b"".join(parts).decode("utf-8") for ebook_id, parts in chunks.items()}
+
+
+# Migration step: move inline content of existing rows into the store
+def move_inline_content(conn, batch_size=200):
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            """
+            SELECT id, content FROM ebooks
+            WHERE id > ? AND content != ''
+            ORDER BY id
+            LIMIT ?
+            """,
+            (last_id, batch_size),
+        ).fetchall()
+        if not rows:
+            break
+        for ebook_id, text in rows:
+            write_content(conn, ebook_id, text, index=False)
+        last_id = rows[-1][0]
@@ -0,0 +1,157 @@
+import argparse
+import math
+import random
+import time
+from datetime import date, timedelta
+from itertools import accumulate
+from db import get_db_connection, init_db
+from passwords import hash_password
+from imports import import_ebooks, import_sections
+
+# Every generated user logs in with this password
+PASSWORD = "password"
+
+WORDS = (
+    "the of and to in a is that for it as was with be by on not he this are or his from at which but have an they "
+    "you were her she there been one all we their has would when if so no will more out up into do any your what "
+    "time river city night house light world war king ship star door voice garden letter winter summer island "
+    "ancient silent broken hidden golden distant quiet bright empty strange final secret lost dark young old"
+).split()
+FIRST_NAMES = ("Ada", "Ben", "Chen", "Dara", "Eli", "Fatima", "Gabriel", "Hana", "Ivan", "Jun", "Kofi", "Lena", "Mateo", "Nia", "Omar", "Priya")
+LAST_NAMES = ("Adams", "Brown", "Costa", "Dubois", "Evans", "Fischer", "Garcia", "Haddad", "Ito", "Jensen", "Kim", "Lopez", "Moreau", "Novak")
+
+# Request statuses with their share of the history. At most five requests
+# per user are left open ("requested"), like the API allows.
+STATUS_WEIGHTS = {"returned": 55, "granted": 15, "requested": 10, "rejected": 10, "expired": 10}
+MAX_OPEN_REQUESTS = 5
+HISTORY_DAYS = 365
+
+
+def _text(rng, size):
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+
+# Content sizes follow a log-normal distribution around content_kb
+def _content_size(rng, content_kb):
+    return max(200, int(rng.lognormvariate(math.log(content_kb * 1024), 0.8)))
+
+
+def generate_users(conn, count):
+    hashed = hash_password(PASSWORD)
+    first = conn.execute("SELECT COUNT(*) FROM users WHERE role = 'user'").fetchone()[0] + 1
+    conn.executemany(
+        "INSERT INTO users (username, password, role) VALUES (?, ?, 'user')",
+        ((f"user{i}", hashed) for i in range(first, first + count)),
+    )
+    conn.commit()
+    return [row[0] for row in conn.execute("SELECT id FROM users WHERE role = 'user'")]
+
+
+def generate_sections(conn, rng, count):
+    records = (
+        (line, {"name": f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {line}", "description": _text(rng, 120)})
+        for line in range(1, count + 1)
+    )
+    import_sections(conn, records)
+    return [row[0] for row in conn.execute("SELECT id FROM sections")]
+
+
+def generate_ebooks(conn, rng, count, section_ids, content_kb):
+    today = date.today()
+    authors = [f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}" for _ in range(max(1, count // 10))]
+    # A few prolific authors, a long tail of others (Zipf-like)
+    author_weights = list(accumulate(1 / rank for rank in range(1, len(authors) + 1)))
+    records = (
+        (line, {
+            "section_id": rng.choice(section_ids),
+            "name": " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))).title(),
+            "content": _text(rng, _content_size(rng, content_kb)),
+            "author": rng.choices(authors, cum_weights=author_weights)[0],
+            "date_issued": (today - timedelta(days=rng.randrange(20 * 365))).isoformat(),
+        })
+        for line in range(1, count + 1)
+    )
+    import_ebooks(conn, records)
+    return [row[0] for row in conn.execute("SELECT id FROM ebooks")]
+
+
+def generate_requests(conn, rng, count, user_ids, ebook_ids, batch_size=50000):
+    today = date.today()
+    statuses = list(STATUS_WEIGHTS)
+    weights = list(STATUS_WEIGHTS.values())
+    open_requests = {}
+
+    def rows(n):
+        for _ in range(n):
+            user_id = rng.choice(user_ids)
+            status = rng.choices(statuses, weights)[0]
+            if status == "requested":
+                if open_requests.get(user_id, 0) >= MAX_OPEN_REQUESTS:
+                    status = "returned"
+                else:
+                    open_requests[user_id] = open_requests.get(user_id, 0) + 1
+            # Open and granted requests are recent; expired ones are past due
+            age = rng.randrange(30) if status in ("requested", "granted") else rng.randrange(30, HISTORY_DAYS)
+            requested = today - timedelta(days=age)
+            returned = requested + timedelta(days=rng.randrange(7, 29))
+            if status == "granted" and returned < today:
+                returned = today + timedelta(days=rng.randrange(1, 14))
+            yield user_id, rng.choice(ebook_ids), requested.isoformat(), returned.isoformat(), status
+
+    for start in range(0, count, batch_size):
+        conn.executemany(
+            "INSERT INTO ebook_requests (user_id, ebook_id, request_date, return_date, status) VALUES (?, ?, ?, ?, ?)",
+            rows(min(batch_size, count - start)),
+        )
+        conn.commit()
+
+
+def generate_feedback(conn, rng, count, user_ids, ebook_ids, batch_size=50000):
+    today = date.today()
+    for start in range(0, count, batch_size):
+        conn.executemany(
+            "INSERT INTO feedback (user_id, ebook_id, feedback, feedback_date) VALUES (?, ?, ?, ?)",
+            (
+                (rng.choice(user_ids), rng.choice(ebook_ids), _text(rng, rng.randrange(20, 400)),
+                 (today - timedelta(days=rng.randrange(HISTORY_DAYS))).isoformat())
+                for _ in range(min(batch_size, count - start))
+            ),
+        )
+        conn.commit()
+
+
+# Fill the database with a synthetic library. On an empty database the same
+# seed always produces the same data, with dates relative to today.
+def generate(conn, users=1000, sections=20, ebooks=10000, requests=100000, feedback=20000, content_kb=8, seed=42):
+    rng = random.Random(seed)
+    user_ids = generate_users(conn, users)
+    section_ids = generate_sections(conn, rng, sections)
+    ebook_ids = generate_ebooks(conn, rng, ebooks, section_ids, content_kb)
+    if user_ids and ebook_ids:
+        generate_requests(conn, rng, requests, user_ids, ebook_ids)
+        generate_feedback(conn, rng, feedback, user_ids, ebook_ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a large synthetic dataset")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--sections", type=int, default=20)
+    parser.add_argument("--ebooks", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--feedback", type=int, default=20000)
+    parser.add_argument("--content-kb", type=float, default=8, help="median ebook content size")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    init_db()
+    conn = get_db_connection()
+    started = time.perf_counter()
+    generate(conn, args.users, args.sections, args.ebooks, args.requests, args.feedback, args.content_kb, args.seed)
+    conn.close()
+    print(f"Generated data in {time.perf_counter() - started:.1f}s")
@@ -1,28 +1,288 @@
+import os
+import random
 import sqlite3
+import threading
+import time
 from werkzeug.security import generate_password_hash
+from migrations import migrate
+from metrics import record_query
+
+
+# Path to the SQLite database, configurable through the environment
+DATABASE_PATH = os.getenv("DATABASE_PATH", "database.db")
+
+# Connection tuning, see https://www.sqlite.org/pragma.html
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB") or 20000)
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE") or 256 * 1024 * 1024)
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS") or 5000)
+
+# Write transactions wait up to DB_LOCK_ATTEMPT_MS for the write lock, then
+# back off for a random time (doubling up to DB_LOCK_BACKOFF_MAX_MS) and try
+# again, at most DB_LOCK_RETRIES times
+DB_LOCK_ATTEMPT_MS = int(os.getenv("DB_LOCK_ATTEMPT_MS") or 250)
+DB_LOCK_RETRIES = int(os.getenv("DB_LOCK_RETRIES") or 8)
+DB_LOCK_BACKOFF_MS = float(os.getenv("DB_LOCK_BACKOFF_MS") or 5)
+DB_LOCK_BACKOFF_MAX_MS = float(os.getenv("DB_LOCK_BACKOFF_MAX_MS") or 200)
+
+
+# Raised when the write lock couldn't be taken after every retry
+class DatabaseBusy(Exception):
+    pass
+
+
+def is_locked_error(error):
+    message = str(error)
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
+
+# A cursor that reports every statement it runs to the metrics module
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_query(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_query(sql, time.perf_counter() - started)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            record_query(sql_script, time.perf_counter() - started)
+
+
+# A connection that goes back to its pool instead of closing.
+# Handlers keep calling conn.close() when they are done; the underlying
+# sqlite connection stays open and is reused by the next request on the
+# same worker thread.
+class PooledConnection(sqlite3.Connection):
+    pool = None
+
+    def close(self):
+        if self.pool is None:
+            return super().close()
+        self.pool.release(self)
+
+    def really_close(self):
+        super().close()
+
+    # Statements are timed by TimedCursor, including the conn.execute()
+    # shortcuts, which sqlite3 would otherwise run on a plain cursor
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+# One tuned connection per worker thread, reused across requests
+class ConnectionPool:
+    def __init__(self, path=None):
+        self.path = path or DATABASE_PATH
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = {}
+        self._pid = os.getpid()
+        self._created = 0
+        self._acquired = 0
+        self._reused = 0
+        self._closed = 0
+        self._lock_waits = 0
+        self._lock_wait_seconds = 0.0
+        self._lock_retries = 0
+        self._lock_failures = 0
+
+    def configure(self, path):
+        self.reset()
+        self.path = path
+
+    def _connect(self):
+        # Each connection is only used by the thread that opened it, but
+        # _prune closes the ones left behind by exited threads. sqlite3
+        # refuses that by default (ProgrammingError from another thread),
+        # so the same-thread check is turned off.
+        conn = sqlite3.connect(
+            self.path,
+            factory=PooledConnection,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.pool = self
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+        conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    # Called with self._lock held
+    def _check_fork(self):
+        # Connections must never be shared across processes
+        if os.getpid() != self._pid:
+            self._local = threading.local()
+            self._connections = {}
+            self._pid = os.getpid()
+
+    def _prune(self):
+        alive = {thread.ident for thread in threading.enumerate()}
+        for ident in list(self._connections):
+            if ident not in alive:
+                self._connections.pop(ident).really_close()
+                self._closed += 1
+
+    def acquire(self):
+        with self._lock:
+            self._check_fork()
+            conn = getattr(self._local, "conn", None)
+            self._acquired += 1
+            if conn is None:
+                self._prune()
+                # A new thread can reuse the ident of an exited one whose
+                # connection _prune can't tell apart from a live thread's
+                stale = self._connections.pop(threading.get_ident(), None)
+                if stale is not None:
+                    stale.really_close()
+                    self._closed += 1
+                conn = self._connect()
+                self._local.conn = conn
+                self._local.depth = 0
+                self._connections[threading.get_ident()] = conn
+                self._created += 1
+            else:
+                self._reused += 1
+        self._local.depth += 1
+        return conn
+
+    def release(self, conn):
+        if getattr(self._local, "conn", None) is not conn:
+            return
+        self._local.depth = max(self._local.depth - 1, 0)
+        # Drop anything the last holder left uncommitted
+        if self._local.depth == 0 and conn.in_transaction:
+            conn.rollback()
+
+    def release_all(self):
+        # Called at the end of each request
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.depth = 1
+            self.release(conn)
+
+    def reset(self):
+        with self._lock:
+            for conn in self._connections.values():
+                conn.really_close()
+                self._closed += 1
+            self._connections = {}
+            self._local = threading.local()
+            self._pid = os.getpid()
+
+    # Run work(conn) in a transaction that takes the write lock up front
+    # (BEGIN IMMEDIATE), so checks and writes inside it can't interleave
+    # with another writer's. Lock timeouts are retried with jittered
+    # exponential backoff; DatabaseBusy is raised once retries run out.
+    def transaction(self, conn, work):
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute(f"PRAGMA busy_timeout = {DB_LOCK_ATTEMPT_MS}")
+        try:
+            backoff = DB_LOCK_BACKOFF_MS
+            for attempt in range(DB_LOCK_RETRIES + 1):
+                started = time.perf_counter()
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    waited = time.perf_counter() - started
+                    result = work(conn)
+                    conn.commit()
+                except sqlite3.OperationalError as error:
+                    if conn.in_transaction:
+                        conn.rollback()
+                    if not is_locked_error(error):
+                        raise
+                    self._count_lock_wait(time.perf_counter() - started, retried=attempt < DB_LOCK_RETRIES)
+                    if attempt < DB_LOCK_RETRIES:
+                        time.sleep(random.uniform(0, backoff) / 1000)
+                        backoff = min(backoff * 2, DB_LOCK_BACKOFF_MAX_MS)
+                    continue
+                except BaseException:
+                    if conn.in_transaction:
+                        conn.rollback()
+                    raise
+                self._count_lock_wait(waited)
+                return result
+            with self._lock:
+                self._lock_failures += 1
+            raise DatabaseBusy()
+        finally:
+            conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+
+    def _count_lock_wait(self, seconds, retried=False):
+        with self._lock:
+            # Taking a free lock is sub-millisecond; anything longer waited
+            if seconds >= 0.001:
+                self._lock_waits += 1
+            self._lock_wait_seconds += seconds
+            self._lock_retries += retried
+
+    def stats(self):
+        with self._lock:
+            return {
+                "path": self.path,
+                "pid": self._pid,
+                "open_connections": len(self._connections),
+                "created": self._created,
+                "acquired": self._acquired,
+                "reused": self._reused,
+                "closed": self._closed,
+                "lock_waits": self._lock_waits,
+                "lock_wait_seconds": round(self._lock_wait_seconds, 6),
+                "lock_retries": self._lock_retries,
+                "lock_failures": self._lock_failures,
+            }
+
+    def init_app(self, app):
+        if app.config.get("DATABASE_PATH"):
+            self.configure(app.config["DATABASE_PATH"])
+        app.teardown_appcontext(lambda exc: self.release_all())
+
+
+pool = ConnectionPool()
 
 
 # Function to connect to the database
 def get_db_connection():
-    conn = sqlite3.connect("database.db")
-    conn.row_factory = sqlite3.Row
-    return conn
+    return pool.acquire()
+
+
+# Run work(conn) in a write transaction, see ConnectionPool.transaction
+def write_transaction(conn, work):
+    return pool.transaction(conn, work)
 
 
 # Initialize the database
 def init_db():
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL,
-            password TEXT NOT NULL,
-            role TEXT NOT NULL
-        )
-    """)
+    migrate(conn)
 
     # Insert a librarian if no such user exists
+    cursor = conn.cursor()
     cursor.execute("""
         SELECT COUNT(*) FROM users WHERE role = 'librarian'
     """)
@@ -35,46 +295,5 @@ def init_db():
         """,
             ("librarian", generate_password_hash("librarian"), "librarian"),
         )
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS sections (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            created_at timestamp NOT NULL DEFAULT current_timestamp,
-            description TEXT NOT NULL
-        )
-    """)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS ebooks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            section_id INTEGER NOT NULL,
-            name TEXT NOT NULL,
-            content TEXT NOT NULL,
-            author TEXT NOT NULL,
-            date_issued date NOT NULL
-        )
-    """)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS ebook_requests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            ebook_id INTEGER NOT NULL,
-            request_date date NOT NULL,
-            return_date date NOT NULL,
-            status TEXT NOT NULL, -- e.g., 'requested', 'granted', 'returned', 'expired'
-            FOREIGN KEY (user_id) REFERENCES users(id),
-            FOREIGN KEY (ebook_id) REFERENCES ebooks(id)
-        );
-    """)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS feedback (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            ebook_id INTEGER NOT NULL,
-            feedback TEXT NOT NULL,
-            feedback_date date NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users(id),
-            FOREIGN KEY (ebook_id) REFERENCES ebooks(id)
-        );
-    """)
     conn.commit()
     conn.close()
@@ -1,12 +1,85 @@
 from flask_jwt_extended import get_jwt_identity, jwt_required
-from db import get_db_connection
+from db import get_db_connection, write_transaction
 from flask import Blueprint, request, jsonify
 from datetime import datetime
-from cache import cache
-from users import UserIdentity, is_user
+from cache import cache, invalidate, tagged_key
+from users import UserIdentity, is_librarian, is_user
+from streaming import requested_stream_format, stream_query
+from write_queue import write_queue
+from serializers import fetch_rows, requested_format, rows_response
 
 ebook_requests_bp = Blueprint("ebook_requests", __name__)
 
+CATALOG_STATUS_TIMEOUT = 300
+
+# Open ("requested") requests a user may have at once
+MAX_OPEN_REQUESTS = 5
+
+# Statuses a batch update may set; the scheduler and the dashboards know
+# exactly these
+REQUEST_STATUSES = ("requested", "granted", "returned", "expired")
+
+# Columns a batch update may select requests by
+BATCH_FILTER_KEYS = ("ebook_id", "user_id", "status")
+
+
+# The map is keyed by the user's cache tag, which every write to their
+# requests bumps after committing. A reader that queried before a write
+# stores its map under the old generation, so it can never hide the write.
+def catalog_status_key(user_id):
+    return tagged_key("catalog_status", [f"user:{user_id}"])
+
+
+# Latest request status of every ebook the user has requested, as a map of
+# ebook_id -> status. The map is cached per user and rebuilt after the
+# user's requests change, so the catalog view never has to query per ebook.
+def get_catalog_status(conn, user_id):
+    key = catalog_status_key(user_id)
+    statuses = cache.get(key)
+    if statuses is None:
+        rows = conn.execute(
+            """
+            SELECT ebook_id, status FROM ebook_requests
+            WHERE id IN (
+                SELECT MAX(id) FROM ebook_requests
+                WHERE user_id = ?
+                GROUP BY ebook_id
+            )
+        """,
+            (user_id,),
+        ).fetchall()
+        statuses = {row["ebook_id"]: row["status"] for row in rows}
+        cache.set(key, statuses, timeout=CATALOG_STATUS_TIMEOUT)
+    return statuses
+
+
+# Look up the owner and ebook of a request before it is changed
+def get_request_owner(conn, id):
+    return conn.execute(
+        "SELECT user_id, ebook_id FROM ebook_requests WHERE id = ?", (id,)
+    ).fetchone()
+
+
+# Insert a request only while the user is under the limit of open requests
+ADMIT_REQUEST = """
+    INSERT INTO ebook_requests (user_id, ebook_id, request_date, return_date, status)
+    SELECT ?, ?, ?, ?, ?
+    WHERE (
+        SELECT COUNT(*) FROM ebook_requests
+        WHERE user_id = ? AND status = 'requested'
+    ) < ?
+"""
+
+
+# Bring caches up to date after a request was inserted (rowcount 1)
+def request_admitted(user_id, rowcount):
+    if not rowcount:
+        return
+
+    # Invalidate everything showing this user's requests, including their
+    # catalog status map
+    invalidate("table:ebook_requests", f"user:{int(user_id)}")
+
 
 @ebook_requests_bp.route("/ebook_requests", methods=["POST"])
 @jwt_required()
@@ -33,49 +106,51 @@ def create_ebook_request():
             {"message": "Return Date cannot be earlier than Request Date!"}
         ), 400
 
-    # Check the number of existing requests by the user
+    params = (user_id, ebook_id, request_date.isoformat(), return_date.isoformat(), status,
+              user_id, MAX_OPEN_REQUESTS)
+
+    # With the write queue on, the insert is committed with others in a
+    # batch. Queued acknowledgements can't report the limit: requests over
+    # it are dropped when their batch runs.
+    if write_queue.enabled:
+        admitted = write_queue.write(ADMIT_REQUEST, params, lambda rowcount: request_admitted(user_id, rowcount))
+        if not write_queue.durable:
+            return jsonify({"message": "Ebook request accepted!"}), 202
+        if not admitted:
+            return jsonify({"message": "You can only request a maximum of 5 books!"}), 400
+        return jsonify({"message": "Ebook request created successfully!"}), 201
+
+    # The count and the insert run in one statement under the write lock,
+    # so concurrent submissions can't both pass the check. DatabaseBusy, if
+    # the write lock can't be had, becomes a 503 (see app.py).
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT COUNT(*) FROM ebook_requests
-        WHERE user_id = ? AND status = 'requested'
-    """,
-        (user_id,),
-    )
-    request_count = cursor.fetchone()[0]
-
-    if request_count >= 5:
-        conn.close()
-        return jsonify({"message": "You can only request a maximum of 5 books!"}), 400
-
-    # Create the new ebook request
-    cursor.execute(
-        """
-        INSERT INTO ebook_requests (user_id, ebook_id, request_date, return_date, status)
-        VALUES (?, ?, ?, ?, ?)
-    """,
-        (user_id, ebook_id, request_date.isoformat(), return_date.isoformat(), status),
-    )
-    conn.commit()
+    admitted = write_transaction(conn, lambda conn: conn.execute(ADMIT_REQUEST, params).rowcount)
     conn.close()
+    if not admitted:
+        return jsonify({"message": "You can only request a maximum of 5 books!"}), 400
 
-    # Invalidate the cache for all ebooks
-    cache.delete("ebooks")
+    request_admitted(user_id, admitted)
 
     return jsonify({"message": "Ebook request created successfully!"}), 201
 
 
-# Get all ebook requests
+# Get all ebook requests, optionally streamed (?stream=ndjson|json)
 @ebook_requests_bp.route("/ebook_requests", methods=["GET"])
 def get_ebook_requests():
+    fmt = requested_stream_format()
+    if fmt:
+        return stream_query("SELECT * FROM ebook_requests", fmt=fmt)
+
+    try:
+        row_format = requested_format()
+    except ValueError:
+        return jsonify({"message": "Invalid format parameter!"}), 400
+
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM ebook_requests")
-    ebook_requests = cursor.fetchall()
+    columns, ebook_requests = fetch_rows(conn, "SELECT * FROM ebook_requests")
     conn.close()
 
-    return jsonify([dict(row) for row in ebook_requests]), 200
+    return rows_response(columns, ebook_requests, row_format)
 
 
 # Get all ebook requests by user
@@ -86,15 +161,18 @@ def get_ebook_requests_from_user():
 
     if not is_user(current_user):
         return jsonify({"message": "You are not a user"}), 403
+    try:
+        row_format = requested_format()
+    except ValueError:
+        return jsonify({"message": "Invalid format parameter!"}), 400
+
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT * FROM ebook_requests WHERE user_id = ?", (str(current_user["id"]))
+    columns, ebook_requests = fetch_rows(
+        conn, "SELECT * FROM ebook_requests WHERE user_id = ?", (current_user["id"],)
     )
-    ebook_requests = cursor.fetchall()
     conn.close()
 
-    return jsonify([dict(row) for row in ebook_requests]), 200
+    return rows_response(columns, ebook_requests, row_format)
 
 
 # Get a single ebook request by ID
@@ -122,6 +200,7 @@ def update_ebook_request(id):
         return jsonify({"message": "Status is required!"}), 400
 
     conn = get_db_connection()
+    owner = get_request_owner(conn, id)
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -134,22 +213,115 @@ def update_ebook_request(id):
     conn.commit()
     conn.close()
 
-    # Invalidate the cache for all ebooks
-    cache.delete("ebooks")
+    # Invalidate everything showing the owner's requests
+    invalidate("table:ebook_requests", *([f"user:{owner['user_id']}"] if owner else []))
 
     return jsonify({"message": "Ebook request updated successfully!"}), 200
 
 
+# Update many ebook requests in one transaction. The body is either
+#   {"updates": [{"id": 1, "status": "granted"}, ...]}
+# or a filter applied to every matching request:
+#   {"filter": {"ebook_id": 3, "status": "requested"}, "status": "granted"}
+@ebook_requests_bp.route("/ebook_requests/batch", methods=["PUT"])
+@jwt_required()
+def update_ebook_requests_batch():
+    current_user: UserIdentity = get_jwt_identity()
+
+    if not is_librarian(current_user):
+        return jsonify({"message": "You are not a librarian"}), 403
+
+    batch = request.get_json(silent=True)
+    if not isinstance(batch, dict):
+        return jsonify({"message": "Either updates or filter is required!"}), 400
+    # (id, status, valid) in request order
+    entries = []
+
+    if "updates" in batch:
+        updates = batch["updates"] or []
+        if not isinstance(updates, list):
+            return jsonify({"message": "updates must be a list!"}), 400
+        for update in updates:
+            id = update.get("id") if isinstance(update, dict) else None
+            status = update.get("status") if isinstance(update, dict) else None
+            # JSON true and false are ints to Python
+            valid = isinstance(id, int) and not isinstance(id, bool) and status in REQUEST_STATUSES
+            entries.append((id, status, valid))
+    elif "filter" in batch:
+        criteria = batch["filter"] or {}
+        status = batch.get("status")
+        if not isinstance(criteria, dict) or not all(
+            isinstance(criteria[key], (int, str)) for key in BATCH_FILTER_KEYS if key in criteria
+        ):
+            return jsonify({"message": "A filter and a valid status are required!"}), 400
+        conditions = [f"{key} = ?" for key in BATCH_FILTER_KEYS if key in criteria]
+        if status not in REQUEST_STATUSES or not conditions:
+            return jsonify({"message": "A filter and a valid status are required!"}), 400
+    else:
+        return jsonify({"message": "Either updates or filter is required!"}), 400
+
+    # The selection, the existence check and the update run under one write
+    # lock; DatabaseBusy becomes a 503 (see app.py)
+    def work(conn):
+        selected = entries
+        if "filter" in batch:
+            rows = conn.execute(
+                f"SELECT id FROM ebook_requests WHERE {' AND '.join(conditions)}",
+                [criteria[key] for key in BATCH_FILTER_KEYS if key in criteria],
+            ).fetchall()
+            selected = [(row["id"], status, True) for row in rows]
+        updates = [(id, status) for id, status, valid in selected if valid]
+
+        # Find which requests exist, and who they belong to
+        owners = {}
+        ids = list({id for id, _ in updates})
+        for start in range(0, len(ids), 500):
+            batch_ids = ids[start : start + 500]
+            placeholders = ", ".join("?" * len(batch_ids))
+            for row in conn.execute(
+                f"SELECT id, user_id FROM ebook_requests WHERE id IN ({placeholders})",
+                batch_ids,
+            ):
+                owners[row["id"]] = row["user_id"]
+
+        found = [(status, id) for id, status in updates if id in owners]
+        conn.executemany("UPDATE ebook_requests SET status = ? WHERE id = ?", found)
+        return selected, owners, found
+
+    conn = get_db_connection()
+    try:
+        entries, owners, found = write_transaction(conn, work)
+    finally:
+        conn.close()
+
+    results = [
+        {
+            "id": id,
+            "status": status,
+            "result": "invalid" if not valid else "updated" if id in owners else "not_found",
+        }
+        for id, status, valid in entries
+    ]
+
+    # Invalidate the caches once for the whole batch
+    if found:
+        users = {owners[id] for _, id in found}
+        invalidate("table:ebook_requests", *(f"user:{user_id}" for user_id in users))
+
+    return jsonify({"updated": len(found), "results": results}), 200
+
+
 # Delete an ebook request
 @ebook_requests_bp.route("/ebook_requests/<int:id>", methods=["DELETE"])
 def delete_ebook_request(id):
     conn = get_db_connection()
+    owner = get_request_owner(conn, id)
     cursor = conn.cursor()
     cursor.execute("DELETE FROM ebook_requests WHERE id = ?", (id,))
     conn.commit()
     conn.close()
 
-    # Invalidate the cache for all ebooks
-    cache.delete("ebooks")
+    # Invalidate everything showing the owner's requests
+    invalidate("table:ebook_requests", *([f"user:{owner['user_id']}"] if owner else []))
 
     return jsonify({"message": "Ebook request deleted successfully!"}), 200
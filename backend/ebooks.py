@@ -1,9 +1,23 @@
-from flask import Blueprint, request, jsonify
+from datetime import date
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from db import get_db_connection
-from cache import cache
+from cache import cached_by_tags, invalidate
 from sections import section_exists
+from etags import conditional
+from serializers import fetch_rows, requested_format, rows_response
 from users import UserIdentity, is_librarian, is_user
+from ebook_requests import get_catalog_status
+from content_store import (
+    CHUNK_SIZE,
+    char_boundary,
+    content_size,
+    delete_content,
+    iter_content,
+    read_content,
+    read_contents,
+    write_content,
+)
 
 ebooks_bp = Blueprint("ebooks", __name__)
 
@@ -60,55 +74,249 @@ def create_ebook():
     cursor.execute(
         """
         INSERT INTO ebooks (section_id, name, content, author, date_issued)
-        VALUES (?, ?, ?, ?, ?)
+        VALUES (?, ?, '', ?, ?)
         """,
-        (section_id, name, content, author, date_issued),
+        (section_id, name, author, date_issued),
     )
+    write_content(conn, cursor.lastrowid, content)
     conn.commit()
     conn.close()
 
     # Invalidate the cache for all ebooks
-    cache.delete("ebooks")
-    cache.delete("sections")
+    invalidate("table:ebooks")
 
     return jsonify({"message": "Ebook created successfully!"}), 201
 
 
-# Get all ebooks
+# Largest page size a client may ask for
+MAX_PAGE_SIZE = 1000
+
+# Columns a listing may select. Listings leave out the book content by
+# default; it is only served by GET /ebooks/<id> unless asked for.
+EBOOK_FIELDS = ("id", "section_id", "name", "author", "date_issued", "content_size", "content")
+SUMMARY_FIELDS = ("id", "section_id", "name", "author", "date_issued")
+
+
+# Parse the fields= selector into a whitelisted, canonically ordered tuple
+def parse_ebook_fields(args):
+    raw = args.get("fields")
+    if not raw:
+        return SUMMARY_FIELDS
+    requested = {field.strip() for field in raw.split(",") if field.strip()}
+    if not requested <= set(EBOOK_FIELDS):
+        raise ValueError("unknown field")
+    # The id is always returned, it is the pagination cursor
+    requested.add("id")
+    return tuple(field for field in EBOOK_FIELDS if field in requested)
+
+
+# SELECT list for a projection, optionally qualified with a table name.
+# The content comes from the content store, see attach_content.
+def ebook_columns(fields, table=None):
+    columns = [field for field in fields if field != "content"]
+    if table:
+        return ", ".join(f"{table}.{field}" for field in columns)
+    return ", ".join(columns)
+
+
+# Add the content column to listed ebook rows when the projection asks for it
+def attach_content(conn, columns, rows, fields):
+    if "content" not in fields:
+        return columns, rows
+    id_index = columns.index("id")
+    contents = read_contents(conn, [row[id_index] for row in rows])
+    return columns + ["content"], [row + (contents[row[id_index]],) for row in rows]
+
+
+# An integer query parameter, None when absent. Unlike args.get(type=int)
+# a value that isn't a number raises ValueError instead of being ignored.
+def int_arg(args, key):
+    value = args.get(key)
+    return None if value is None else int(value)
+
+
+# Parse and normalize the listing filters, raising ValueError on bad input
+def parse_ebook_filters(args):
+    filters = {
+        "section_id": int_arg(args, "section_id"),
+        "author": (args.get("author") or "").strip() or None,
+        "date_from": args.get("date_from") or None,
+        "date_to": args.get("date_to") or None,
+        "cursor": int_arg(args, "cursor"),
+        "limit": int_arg(args, "limit"),
+        "fields": parse_ebook_fields(args),
+        "format": requested_format(),
+    }
+    for key in ("date_from", "date_to"):
+        if filters[key]:
+            filters[key] = date.fromisoformat(filters[key][:10]).isoformat()
+    if filters["limit"] is not None:
+        if filters["limit"] < 1:
+            raise ValueError("limit must be positive")
+        filters["limit"] = min(filters["limit"], MAX_PAGE_SIZE)
+    return filters
+
+
+# Cache variant of a listing: its normalized filters
+def ebooks_cache_params():
+    try:
+        filters = parse_ebook_filters(request.args)
+    except ValueError:
+        return "invalid"
+    filters["fields"] = ",".join(filters["fields"])
+    return "&".join(f"{key}={value}" for key, value in sorted(filters.items()) if value is not None)
+
+
+# Get all ebooks, optionally filtered and paginated by id.
+# Returns the summary projection unless fields= asks for more.
 @ebooks_bp.route("/ebooks", methods=["GET"])
-@cache.cached(timeout=60, key_prefix="ebooks")
+@conditional(lambda: ["table:ebooks"])
+@cached_by_tags(lambda: ["table:ebooks"], params=ebooks_cache_params)
 def get_ebooks():
-    section_id = request.args.get("section_id")
+    try:
+        filters = parse_ebook_filters(request.args)
+    except ValueError:
+        return jsonify({"message": "Invalid filter or pagination parameters!"}), 400
+
+    conditions = []
+    params = []
+    if filters["section_id"] is not None:
+        conditions.append("section_id = ?")
+        params.append(filters["section_id"])
+    if filters["author"]:
+        conditions.append("author = ? COLLATE NOCASE")
+        params.append(filters["author"])
+    if filters["date_from"]:
+        conditions.append("date_issued >= ?")
+        params.append(filters["date_from"])
+    if filters["date_to"]:
+        conditions.append("date_issued < DATE(?, '+1 day')")
+        params.append(filters["date_to"])
+    if filters["cursor"] is not None:
+        conditions.append("id > ?")
+        params.append(filters["cursor"])
+
+    query = f"SELECT {ebook_columns(filters['fields'])} FROM ebooks"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY id"
+    if filters["limit"] is not None:
+        # Fetch one extra row to know whether another page follows
+        query += " LIMIT ?"
+        params.append(filters["limit"] + 1)
 
     conn = get_db_connection()
-    cursor = conn.cursor()
+    columns, ebooks = fetch_rows(conn, query, params)
 
-    # # if section_id:
-    #     cursor.execute("SELECT * FROM ebooks WHERE section_id = ?", (section_id,))
-    # else:
-    cursor.execute("SELECT * FROM ebooks")
+    next_cursor = None
+    if filters["limit"] is not None and len(ebooks) > filters["limit"]:
+        ebooks = ebooks[: filters["limit"]]
+        next_cursor = ebooks[-1][columns.index("id")]
 
-    ebooks = cursor.fetchall()
+    columns, ebooks = attach_content(conn, columns, ebooks, filters["fields"])
     conn.close()
 
-    ebooks_list = [dict(ebook) for ebook in ebooks]
-
-    return jsonify(ebooks_list)
+    response = rows_response(columns, ebooks, filters["format"])
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return response
 
 
 # Get an ebook by ID
 @ebooks_bp.route("/ebooks/<int:id>", methods=["GET"])
+@conditional(lambda id: [f"ebook:{id}"])
+@cached_by_tags(lambda id: [f"ebook:{id}"])
 def get_ebook(id):
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM ebooks WHERE id = ?", (id,))
     ebook = cursor.fetchone()
-    conn.close()
 
     if ebook is None:
+        conn.close()
         return jsonify({"message": "Ebook not found!"}), 404
 
-    return jsonify(dict(ebook))
+    ebook = dict(ebook)
+    ebook["content"] = read_content(conn, id)
+    conn.close()
+
+    return jsonify(ebook)
+
+
+# Parse a single "bytes=start-end" range against the content size.
+# Returns (start, end) inclusive, None when absent, raises ValueError
+# when the range can't be satisfied.
+def parse_range(header, size):
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        raise ValueError("unsupported range")
+    first, _, last = spec.strip().partition("-")
+    if first:
+        start = int(first)
+        end = int(last) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    end = min(end, size - 1)
+    if start > end:
+        raise ValueError("unsatisfiable range")
+    return start, end
+
+
+# Stream the content of an ebook. Supports a single HTTP byte range, or
+# ?page=N to read the Nth page of about CHUNK_SIZE bytes (starting at 1).
+# Pages start and end on character boundaries so each one decodes as UTF-8.
+@ebooks_bp.route("/ebooks/<int:id>/content", methods=["GET"])
+def get_ebook_content(id):
+    conn = get_db_connection()
+    size = content_size(conn, id)
+    conn.close()
+
+    if size is None:
+        return jsonify({"message": "Ebook not found!"}), 404
+
+    total_pages = max((size + CHUNK_SIZE - 1) // CHUNK_SIZE, 1)
+    status = 200
+    headers = {"Accept-Ranges": "bytes", "X-Total-Pages": str(total_pages)}
+
+    page = request.args.get("page", type=int)
+    if page is not None:
+        if not 1 <= page <= total_pages:
+            return jsonify({"message": "Page out of range!"}), 400
+        conn = get_db_connection()
+        start = char_boundary(conn, id, (page - 1) * CHUNK_SIZE, size)
+        end = char_boundary(conn, id, page * CHUNK_SIZE, size) - 1
+        conn.close()
+    else:
+        try:
+            byte_range = parse_range(request.headers.get("Range"), size)
+        except ValueError:
+            return Response(status=416, headers={"Content-Range": f"bytes */{size}"})
+        if byte_range is None:
+            start, end = 0, size - 1
+        else:
+            start, end = byte_range
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    headers["Content-Length"] = str(max(end - start + 1, 0))
+
+    def generate():
+        conn = get_db_connection()
+        try:
+            yield from iter_content(conn, id, start, end)
+        finally:
+            conn.close()
+
+    return Response(
+        stream_with_context(generate()),
+        status=status,
+        headers=headers,
+        mimetype="text/plain",
+    )
 
 
 # Update an ebook
@@ -149,17 +357,17 @@ def update_ebook(id):
     cursor.execute(
         """
         UPDATE ebooks
-        SET name = ?, content = ?, author = ?, date_issued = ?, section_id = ?
+        SET name = ?, author = ?, date_issued = ?, section_id = ?
         WHERE id = ?
         """,
-        (name, content, author, date_issued, section_id, id),
+        (name, author, date_issued, section_id, id),
     )
+    write_content(conn, id, content)
     conn.commit()
     conn.close()
 
     # Invalidate the cache for the updated ebook
-    cache.delete("ebooks")
-    cache.delete("sections")
+    invalidate("table:ebooks", f"ebook:{id}")
 
     return jsonify({"message": "Ebook updated successfully!"})
 
@@ -180,12 +388,12 @@ def delete_ebook(id):
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("DELETE FROM ebooks WHERE id = ?", (id,))
+    delete_content(conn, id)
     conn.commit()
     conn.close()
 
     # Invalidate the cache for the deleted ebook
-    cache.delete("ebooks")
-    cache.delete("sections")
+    invalidate("table:ebooks", f"ebook:{id}")
 
     return jsonify({"message": "Ebook deleted successfully!"})
 
@@ -193,58 +401,55 @@ def delete_ebook(id):
 # Get all ebooks that have been requested by a specific user
 @ebooks_bp.route("/ebooks/requests", methods=["GET"])
 @jwt_required()
+@cached_by_tags(lambda: ["table:ebooks", f"user:{get_jwt_identity()['id']}"])
 def get_ebooks_requested_by_user():
     current_user: UserIdentity = get_jwt_identity()
 
     if not is_user(current_user):
         return jsonify({"message": "You are not a user"}), 403
 
+    try:
+        fields = parse_ebook_fields(request.args)
+        fmt = requested_format()
+    except ValueError:
+        return jsonify({"message": "Invalid fields or format parameter!"}), 400
+
     conn = get_db_connection()
-    cursor = conn.cursor()
+    columns, ebooks = fetch_rows(conn, f"SELECT {ebook_columns(fields)} FROM ebooks")
+    columns, ebooks = attach_content(conn, columns, ebooks, fields)
 
-    cursor.execute(
-        """
-        SELECT * FROM EBOOKS
-        """
-    )
-    ebooks = cursor.fetchall()
-    ebooks = [dict(ebook) for ebook in ebooks]
-
-    for ebook in ebooks:
-        cursor.execute(
-            """
-            SELECT status FROM ebook_requests
-            WHERE user_id = ? AND ebook_id = ?
-            ORDER BY id DESC
-            LIMIT 1
-            """,
-            (current_user["id"], ebook["id"]),
-        )
-
-        status = cursor.fetchone()
-        ebook["status"] = status[0] if status else None
+    # One query (or none, when cached) for every ebook's latest status
+    statuses = get_catalog_status(conn, current_user["id"])
+    id_index = columns.index("id")
+    ebooks = [ebook + (statuses.get(ebook[id_index]),) for ebook in ebooks]
 
     conn.close()
 
-    return jsonify(ebooks)
+    return rows_response(columns + ["status"], ebooks, fmt)
 
 
 # Get all ebooks that have been given feedback by a specific user
 @ebooks_bp.route("/ebooks/feedback/<int:user_id>", methods=["GET"])
+@cached_by_tags(lambda user_id: ["table:ebooks", f"user:{user_id}"])
 def get_ebooks_feedback_by_user(user_id):
+    try:
+        fields = parse_ebook_fields(request.args)
+        fmt = requested_format()
+    except ValueError:
+        return jsonify({"message": "Invalid fields or format parameter!"}), 400
+
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT ebooks.*
+    columns, ebooks = fetch_rows(
+        conn,
+        f"""
+        SELECT {ebook_columns(fields, "ebooks")}
         FROM ebooks
         JOIN feedback ON ebooks.id = feedback.ebook_id
         WHERE feedback.user_id = ?
     """,
         (user_id,),
     )
-    ebooks = cursor.fetchall()
+    columns, ebooks = attach_content(conn, columns, ebooks, fields)
     conn.close()
 
-    ebooks_list = [dict(ebook) for ebook in ebooks]
-    return jsonify(ebooks_list)
+    return rows_response(columns, ebooks, fmt)
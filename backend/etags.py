@@ -0,0 +1,42 @@
+import hashlib
+from functools import wraps
+from flask import Response, make_response, request
+from cache import get_generation, get_modified
+
+
+# Strong ETag for the current request from the generations it depends on
+def compute_etag(names):
+    versions = ",".join(f"{name}={get_generation(name)}" for name in names)
+    key = f"{request.path}?{request.query_string.decode()}|{versions}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+# Conditional GET for a view. versions(**view_args) returns the generation
+# names the response depends on; a matching If-None-Match is answered with
+# 304 before the view (or its cache) is touched.
+def conditional(versions):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            names = versions(**kwargs)
+            etag = compute_etag(names)
+            # Weakly, as compressed responses carry a weak ETag
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+                modified = [get_modified(name) for name in names]
+                modified = [value for value in modified if value is not None]
+                if modified:
+                    response.last_modified = max(modified)
+                # Let browsers keep the body but always revalidate it
+                response.cache_control.no_cache = True
+            return response
+
+        return wrapper
+
+    return decorator
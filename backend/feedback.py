@@ -1,9 +1,18 @@
 from db import get_db_connection
+from cache import invalidate
 from flask import Blueprint, request, jsonify
 from datetime import datetime
+from streaming import requested_stream_format, stream_query
+from serializers import fetch_rows, requested_format, rows_response
+from write_queue import write_queue
 
 feedback_bp = Blueprint('feedback', __name__)
 
+INSERT_FEEDBACK = """
+    INSERT INTO feedback (user_id, ebook_id, feedback, feedback_date)
+    VALUES (?, ?, ?, ?)
+"""
+
 # Create a new feedback entry
 @feedback_bp.route('/feedback', methods=['POST'])
 def create_feedback():
@@ -16,27 +25,43 @@ def create_feedback():
     if not user_id or not ebook_id or not feedback_text:
         return jsonify({'message': 'User ID, Ebook ID, and Feedback are required!'}), 400
 
+    params = (user_id, ebook_id, feedback_text, feedback_date)
+
+    # With the write queue on, the insert is committed with others in a batch
+    if write_queue.enabled:
+        write_queue.write(INSERT_FEEDBACK, params, lambda rowcount: invalidate('table:feedback', f'user:{user_id}'))
+        if not write_queue.durable:
+            return jsonify({'message': 'Feedback accepted!'}), 202
+        return jsonify({'message': 'Feedback created successfully!'}), 201
+
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO feedback (user_id, ebook_id, feedback, feedback_date)
-        VALUES (?, ?, ?, ?)
-    """, (user_id, ebook_id, feedback_text, feedback_date))
+    cursor.execute(INSERT_FEEDBACK, params)
     conn.commit()
     conn.close()
 
+    # Invalidate everything showing this user's feedback
+    invalidate('table:feedback', f'user:{user_id}')
+
     return jsonify({'message': 'Feedback created successfully!'}), 201
 
-# Get all feedback entries
+# Get all feedback entries, optionally streamed (?stream=ndjson|json)
 @feedback_bp.route('/feedback', methods=['GET'])
 def get_feedback():
+    fmt = requested_stream_format()
+    if fmt:
+        return stream_query('SELECT * FROM feedback', fmt=fmt)
+
+    try:
+        row_format = requested_format()
+    except ValueError:
+        return jsonify({'message': 'Invalid format parameter!'}), 400
+
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM feedback")
-    feedback_entries = cursor.fetchall()
+    columns, feedback_entries = fetch_rows(conn, "SELECT * FROM feedback")
     conn.close()
 
-    return jsonify([dict(row) for row in feedback_entries]), 200
+    return rows_response(columns, feedback_entries, row_format)
 
 # Get a single feedback entry by ID
 @feedback_bp.route('/feedback/<int:id>', methods=['GET'])
@@ -67,10 +92,14 @@ def update_feedback(id):
         UPDATE feedback
         SET feedback = ?
         WHERE id = ?
+        RETURNING user_id
     """, (feedback_text, id))
+    owner = cursor.fetchone()
     conn.commit()
     conn.close()
 
+    invalidate('table:feedback', *([f'user:{owner["user_id"]}'] if owner else []))
+
     return jsonify({'message': 'Feedback updated successfully!'}), 200
 
 # Delete a feedback entry
@@ -78,8 +107,11 @@ def update_feedback(id):
 def delete_feedback(id):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM feedback WHERE id = ?", (id,))
+    cursor.execute("DELETE FROM feedback WHERE id = ? RETURNING user_id", (id,))
+    owner = cursor.fetchone()
     conn.commit()
     conn.close()
 
+    invalidate('table:feedback', *([f'user:{owner["user_id"]}'] if owner else []))
+
     return jsonify({'message': 'Feedback deleted successfully!'}), 200
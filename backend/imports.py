@@ -0,0 +1,304 @@
+import argparse
+import csv
+import json
+import time
+from datetime import datetime
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from db import get_db_connection
+from cache import invalidate
+from content_store import compress_content, search_text
+from users import is_librarian
+
+imports_bp = Blueprint("imports", __name__)
+
+IMPORT_CHUNK_SIZE = 2000
+# Per-row errors listed in a report; the failed count covers all of them
+MAX_REPORTED_ERRORS = 1000
+
+EBOOK_FIELDS = ("section_id", "name", "content", "author", "date_issued")
+SECTION_FIELDS = ("name", "description")
+# Fields that have to be strings when present
+EBOOK_TEXT_FIELDS = ("name", "content", "author", "date_issued")
+SECTION_TEXT_FIELDS = ("name", "description", "created_at")
+
+
+# Parse a stream of text lines as NDJSON or CSV records. Yields
+# (line number, record) with record None when the line can't be parsed.
+def parse_records(lines, fmt):
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield number, record if isinstance(record, dict) else None
+
+
+def _chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Ids for a batch of inserts. Called inside BEGIN IMMEDIATE, so nobody else
+# can insert into the table until the batch commits.
+def _next_id(conn, table):
+    row = conn.execute(
+        f"""
+        SELECT MAX(
+            COALESCE((SELECT seq FROM sqlite_sequence WHERE name = '{table}'), 0),
+            COALESCE((SELECT MAX(id) FROM {table}), 0)
+        )
+        """
+    ).fetchone()
+    return row[0] + 1
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def to_dict(self):
+        return {"imported": self.imported, "failed": self.failed, "errors": self.errors}
+
+
+def _missing(record, fields):
+    return [field for field in fields if not str(record.get(field) or "").strip()]
+
+
+# First problem with a record's text fields, or None. Undecodable bytes in
+# the body arrive as lone surrogates and are caught here too.
+def _invalid_text(record, fields):
+    for field in fields:
+        value = record.get(field)
+        if value is None:
+            continue
+        if not isinstance(value, str):
+            return f"{field} must be a string"
+        try:
+            value.encode("utf-8")
+        except UnicodeEncodeError:
+            return f"{field} is not valid UTF-8"
+    return None
+
+
+def _invalid_date(record, field):
+    value = record.get(field)
+    if not value:
+        return None
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        return f"{field} must be a date"
+    return None
+
+
+# Import ebooks from (line, record) pairs in chunked transactions. Rows are
+# checked against the section ids loaded once up front; invalid rows are
+# reported and skipped without aborting the batch.
+def import_ebooks(conn, records, chunk_size=IMPORT_CHUNK_SIZE):
+    report = ImportReport()
+    section_ids = {row[0] for row in conn.execute("SELECT id FROM sections")}
+
+    for chunk in _chunks(records, chunk_size):
+        valid = []
+        for line, record in chunk:
+            if record is None:
+                report.error(line, "Malformed record")
+                continue
+            missing = _missing(record, EBOOK_FIELDS)
+            if missing:
+                report.error(line, f"Missing {', '.join(missing)}")
+                continue
+            try:
+                section_id = int(record["section_id"])
+            except (TypeError, ValueError):
+                report.error(line, "section_id must be an integer")
+                continue
+            invalid = _invalid_text(record, EBOOK_TEXT_FIELDS) or _invalid_date(record, "date_issued")
+            if invalid:
+                report.error(line, invalid)
+                continue
+            if section_id not in section_ids:
+                report.error(line, "Section not found")
+                continue
+            valid.append((section_id, record))
+        if not valid:
+            continue
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            first_id = _next_id(conn, "ebooks")
+            ebooks, chunks, texts = [], [], []
+            for ebook_id, (section_id, record) in enumerate(valid, start=first_id):
+                size, rows = compress_content(ebook_id, record["content"])
+                ebooks.append((ebook_id, section_id, record["name"], record["author"], record["date_issued"], size))
+                chunks.extend(rows)
+                texts.append((search_text(record["content"]), ebook_id))
+            conn.executemany(
+                """
+                INSERT INTO ebooks (id, section_id, name, content, author, date_issued, content_size)
+                VALUES (?, ?, ?, '', ?, ?, ?)
+                """,
+                ebooks,
+            )
+            conn.executemany(
+                "INSERT INTO ebook_content_chunks (ebook_id, chunk_no, data) VALUES (?, ?, ?)",
+                chunks,
+            )
+            conn.executemany("UPDATE ebooks_fts SET content = ? WHERE rowid = ?", texts)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        report.imported += len(ebooks)
+    return report
+
+
+# Import sections from (line, record) pairs in chunked transactions
+def import_sections(conn, records, chunk_size=IMPORT_CHUNK_SIZE):
+    report = ImportReport()
+
+    for chunk in _chunks(records, chunk_size):
+        valid = []
+        for line, record in chunk:
+            if record is None:
+                report.error(line, "Malformed record")
+                continue
+            missing = _missing(record, SECTION_FIELDS)
+            if missing:
+                report.error(line, f"Missing {', '.join(missing)}")
+                continue
+            invalid = _invalid_text(record, SECTION_TEXT_FIELDS) or _invalid_date(record, "created_at")
+            if invalid:
+                report.error(line, invalid)
+                continue
+            valid.append(record)
+        if not valid:
+            continue
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                """
+                INSERT INTO sections (name, description, created_at)
+                VALUES (?, ?, COALESCE(?, current_timestamp))
+                """,
+                ((record["name"], record["description"], record.get("created_at") or None) for record in valid),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        report.imported += len(valid)
+    return report
+
+
+# Text lines of the request body, read as a stream. Invalid UTF-8 is kept
+# as surrogates so it fails its row instead of the whole import.
+def _request_lines():
+    return (line.decode("utf-8", "surrogateescape") for line in request.stream)
+
+
+def _request_format():
+    return "csv" if request.mimetype == "text/csv" else "ndjson"
+
+
+# Bulk import ebooks from an NDJSON or CSV body
+@imports_bp.route("/ebooks/import", methods=["POST"])
+@jwt_required()
+def import_ebooks_route():
+    current_user = get_jwt_identity()
+
+    if not is_librarian(current_user):
+        return jsonify({"message": "You are not a librarian"}), 403
+
+    conn = get_db_connection()
+    try:
+        report = import_ebooks(conn, parse_records(_request_lines(), _request_format()))
+    except Exception:
+        # Chunks before the failing one are committed
+        invalidate("table:ebooks")
+        raise
+    finally:
+        conn.close()
+
+    # Invalidate the caches once for the whole import
+    if report.imported:
+        invalidate("table:ebooks")
+
+    return jsonify(report.to_dict()), 200
+
+
+# Bulk import sections from an NDJSON or CSV body
+@imports_bp.route("/sections/import", methods=["POST"])
+@jwt_required()
+def import_sections_route():
+    current_user = get_jwt_identity()
+
+    if not is_librarian(current_user):
+        return jsonify({"message": "You are not a librarian"}), 403
+
+    conn = get_db_connection()
+    try:
+        report = import_sections(conn, parse_records(_request_lines(), _request_format()))
+    except Exception:
+        invalidate("table:sections")
+        raise
+    finally:
+        conn.close()
+
+    if report.imported:
+        invalidate("table:sections")
+
+    return jsonify(report.to_dict()), 200
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import ebooks or sections")
+    parser.add_argument("kind", choices=["ebooks", "sections"])
+    parser.add_argument("path", help="an .ndjson or .csv file")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    fmt = "csv" if args.path.endswith(".csv") else "ndjson"
+    importer = import_ebooks if args.kind == "ebooks" else import_sections
+
+    # The app applies pending migrations and connects the cache, so the
+    # import can invalidate what the server has cached and tagged
+    from app import create_app
+
+    app = create_app({"SCHEDULER_ENABLED": False})
+    started = time.perf_counter()
+    with app.app_context():
+        conn = get_db_connection()
+        try:
+            with open(args.path, encoding="utf-8", errors="surrogateescape", newline="") as lines:
+                report = importer(conn, parse_records(lines, fmt), args.chunk_size)
+        finally:
+            conn.close()
+            invalidate(f"table:{args.kind}")
+    elapsed = time.perf_counter() - started
+
+    print(f"Imported {report.imported} {args.kind}, {report.failed} failed, in {elapsed:.1f} s")
+    for error in report.errors:
+        print(f"  line {error['line']}: {error['error']}")
@@ -0,0 +1,265 @@
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from flask_caching.backends.base import BaseCache
+from flask_caching.backends.rediscache import RedisCache
+
+logger = logging.getLogger(__name__)
+
+
+# Size-bounded in-process LRU with per-entry TTL. Values are kept pickled,
+# which gives an exact byte size and means callers never share mutable
+# objects across threads.
+class LRUStore:
+    def __init__(self, max_bytes, max_items):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.bytes = 0
+        self._entries = OrderedDict()  # key -> (expires, data)
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, data = entry
+            if expires is not None and expires <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data, ttl):
+        if len(data) > self.max_bytes:
+            self.delete(key)
+            return
+        expires = None if not ttl else time.monotonic() + ttl
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (expires, data)
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes or len(self._entries) > self.max_items:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            return self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self.bytes -= len(entry[1])
+        return True
+
+
+# Two-tier cache backend for flask_caching: an in-process LRU (L1) in front
+# of an optional shared Redis (L2). Writes go to both tiers and are
+# broadcast over Redis pub/sub so other workers drop their stale L1 copies.
+# Without Redis it is a plain in-process cache.
+class LayeredCache(BaseCache):
+    def __init__(
+        self,
+        default_timeout=300,
+        l2=None,
+        l1_max_bytes=64 * 1024 * 1024,
+        l1_max_items=10000,
+        l1_ttl=30,
+        channel="cache-invalidations",
+    ):
+        super().__init__(default_timeout)
+        self.l1 = LRUStore(l1_max_bytes, l1_max_items)
+        self.l2 = l2
+        # With a shared tier, L1 copies live at most l1_ttl seconds in case an
+        # invalidation message is lost
+        self.l1_ttl = l1_ttl if l2 is not None else None
+        self.channel = channel
+        self.worker_id = uuid.uuid4().hex
+        self._pid = os.getpid()
+        self._subscriber = None
+        self._counters_lock = threading.Lock()
+        self._inc_lock = threading.Lock()
+        self.counters = {
+            "l1_hits": 0,
+            "l2_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "deletes": 0,
+            "invalidations_sent": 0,
+            "invalidations_received": 0,
+            "l2_errors": 0,
+        }
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(
+            l1_max_bytes=int(config.get("CACHE_L1_MAX_BYTES") or 64 * 1024 * 1024),
+            l1_max_items=int(config.get("CACHE_L1_MAX_ITEMS") or 10000),
+            l1_ttl=int(config.get("CACHE_L1_TTL") or 30),
+        )
+        if config.get("CACHE_REDIS_HOST") or config.get("CACHE_REDIS_URL"):
+            kwargs["l2"] = RedisCache.factory(
+                app, config, [], {"default_timeout": kwargs.get("default_timeout", 300)}
+            )
+        return cls(*args, **kwargs)
+
+    def _count(self, name, amount=1):
+        with self._counters_lock:
+            self.counters[name] += amount
+
+    def _l1_ttl(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        if self.l1_ttl is None:
+            return timeout
+        return min(timeout, self.l1_ttl) if timeout else self.l1_ttl
+
+    # Run an L2 operation; a Redis outage degrades to L1-only instead of failing
+    def _l2(self, method, *args, default=None):
+        if self.l2 is None:
+            return default
+        try:
+            return getattr(self.l2, method)(*args)
+        except Exception:
+            self._count("l2_errors")
+            logger.warning("Shared cache %s failed", method, exc_info=True)
+            return default
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._subscriber = None
+            self.worker_id = uuid.uuid4().hex
+            self.l1.clear()
+        if self.l2 is not None and self._subscriber is None:
+            self._subscriber = threading.Thread(target=self._listen, name="cache-invalidations", daemon=True)
+            self._subscriber.start()
+
+    def _publish(self, key):
+        if self.l2 is None:
+            return
+        self._count("invalidations_sent")
+        self._l2_publish(f"{self.worker_id} {key}")
+
+    def _l2_publish(self, message):
+        try:
+            self.l2._write_client.publish(self.channel, message)
+        except Exception:
+            self._count("l2_errors")
+            logger.warning("Publishing a cache invalidation failed", exc_info=True)
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.l2._read_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    sender, _, key = message["data"].decode().partition(" ")
+                    if sender == self.worker_id:
+                        continue
+                    self._count("invalidations_received")
+                    if key == "*":
+                        self.l1.clear()
+                    else:
+                        self.l1.delete(key)
+            except Exception:
+                self._count("l2_errors")
+                logger.warning("Cache invalidation listener failed, retrying", exc_info=True)
+                # Anything may have changed while we weren't listening
+                self.l1.clear()
+                time.sleep(1)
+
+    def get(self, key):
+        self._check_fork()
+        data = self.l1.get(key)
+        if data is not None:
+            self._count("l1_hits")
+            return pickle.loads(data)
+        value = self._l2("get", key)
+        if value is None:
+            self._count("misses")
+            return None
+        self._count("l2_hits")
+        self.l1.put(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._l1_ttl(None))
+        return value
+
+    def set(self, key, value, timeout=None):
+        self._check_fork()
+        self._count("sets")
+        self.l1.put(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._l1_ttl(timeout))
+        self._l2("set", key, value, timeout)
+        self._publish(key)
+        return True
+
+    def add(self, key, value, timeout=None):
+        self._check_fork()
+        if self.l2 is None:
+            if self.l1.get(key) is not None:
+                return False
+            return self.set(key, value, timeout)
+        added = self._l2("add", key, value, timeout, default=False)
+        if added:
+            self.l1.put(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._l1_ttl(timeout))
+        return added
+
+    def delete(self, key):
+        self._check_fork()
+        self._count("deletes")
+        deleted = self.l1.delete(key)
+        deleted = self._l2("delete", key, default=deleted) or deleted
+        self._publish(key)
+        return deleted
+
+    def has(self, key):
+        return self.get(key) is not None
+
+    def clear(self):
+        self._check_fork()
+        self.l1.clear()
+        self._l2("clear")
+        self._publish("*")
+        return True
+
+    def inc(self, key, delta=1):
+        self._check_fork()
+        if self.l2 is None:
+            with self._inc_lock:
+                value = (self.get(key) or 0) + delta
+                self.l1.put(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), None)
+            return value
+        value = self._l2("inc", key, delta)
+        self.l1.delete(key)
+        self._publish(key)
+        return value
+
+    def dec(self, key, delta=1):
+        return self.inc(key, -delta)
+
+    def stats(self):
+        with self._counters_lock:
+            counters = dict(self.counters)
+        counters.update(
+            l1_items=len(self.l1),
+            l1_bytes=self.l1.bytes,
+            l1_evictions=self.l1.evictions,
+            l1_expirations=self.l1.expirations,
+            shared=self.l2 is not None,
+        )
+        return counters
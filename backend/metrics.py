@@ -0,0 +1,188 @@
+import logging
+import os
+import threading
+import time
+from flask import Response, request
+
+# Statements slower than this are logged to the "slow_queries" logger
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS") or 100)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500)
+
+slow_query_log = logging.getLogger("slow_queries")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+# Minimal metric types rendering the Prometheus text exposition format
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _format_labels(self.labels, key), value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._values.setdefault(labels, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, series in self._values.items():
+                for bound, count in zip(self.buckets + ("+Inf",), series[: len(self.buckets)] + [series[-1]]):
+                    labels = _format_labels(self.labels + ("le",), key + (bound,))
+                    samples.append((f"{self.name}_bucket", labels, count))
+                labels = _format_labels(self.labels, key)
+                samples.append((f"{self.name}_sum", labels, series[-2]))
+                samples.append((f"{self.name}_count", labels, series[-1]))
+        return samples
+
+
+# A metric read from elsewhere at scrape time; read() returns {labels: value}
+class Collected:
+    def __init__(self, name, type, help, labels, read):
+        self.name = name
+        self.type = type
+        self.help = help
+        self.labels = labels
+        self.read = read
+
+    def samples(self):
+        return [(self.name, _format_labels(self.labels, key), value) for key, value in self.read().items()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    # Every sample carries the pid of the process that rendered it: under
+    # serve.py each worker keeps its own counters and a scrape reaches any
+    # one of them, so without it the series would jump between workers
+    def render(self):
+        pid = f'pid="{os.getpid()}"'
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                labels = "{" + pid + ("," + labels[1:] if labels else "}")
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "http_requests_total", "HTTP requests by endpoint and status", ("method", "endpoint", "status")
+))
+http_latency = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to produce a response", ("method", "endpoint")
+))
+http_in_flight = registry.register(Gauge("http_requests_in_flight", "Requests being handled"))
+request_queries = registry.register(Histogram(
+    "http_request_sql_queries", "SQL statements run per request", ("endpoint",), QUERY_COUNT_BUCKETS
+))
+sql_latency = registry.register(Histogram("sql_statement_duration_seconds", "Time to execute a SQL statement", ("operation",)))
+sql_slow = registry.register(Counter("sql_slow_statements_total", f"Statements slower than {SLOW_QUERY_MS:g} ms", ("operation",)))
+
+# Per-thread state of the request being handled
+_current = threading.local()
+
+
+# Called by the connection layer for every statement it runs
+def record_query(sql, seconds):
+    operation = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else "UNKNOWN"
+    sql_latency.observe(seconds, operation)
+    if getattr(_current, "queries", None) is not None:
+        _current.queries += 1
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        sql_slow.inc(operation)
+        slow_query_log.warning("%.1f ms: %s", seconds * 1000, " ".join(sql.split()))
+
+
+def _endpoint():
+    # The route pattern, so /ebooks/1 and /ebooks/2 share a series
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+def _before_request():
+    _current.started = time.perf_counter()
+    _current.queries = 0
+    http_in_flight.inc()
+
+
+def _after_request(response):
+    started = getattr(_current, "started", None)
+    if started is not None:
+        endpoint = _endpoint()
+        http_latency.observe(time.perf_counter() - started, request.method, endpoint)
+        http_requests.inc(request.method, endpoint, response.status_code)
+        request_queries.observe(_current.queries, endpoint)
+    return response
+
+
+def _teardown_request(exc):
+    if getattr(_current, "started", None) is not None:
+        http_in_flight.dec()
+    _current.started = None
+    _current.queries = None
+
+
+# Prometheus text exposition of every registered metric
+def metrics_response():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
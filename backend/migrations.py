@@ -0,0 +1,418 @@
+import argparse
+import logging
+import time
+from aggregates import rebuild_aggregates
+from content_store import move_inline_content
+from search_index import rebuild_search_index
+
+
+logger = logging.getLogger("migrations")
+
+
+# Usernames were not unique before migration 2. The oldest account keeps
+# its name; later duplicates are renamed to name-id (with a further suffix
+# if that is taken too) and logged so their owners can be told.
+def rename_duplicate_usernames(conn):
+    duplicates = conn.execute("""
+        SELECT id, username FROM users
+        WHERE id NOT IN (SELECT MIN(id) FROM users GROUP BY username)
+        ORDER BY id
+    """).fetchall()
+    for user_id, username in duplicates:
+        renamed, attempt = f"{username}-{user_id}", 1
+        while conn.execute("SELECT 1 FROM users WHERE username = ?", (renamed,)).fetchone():
+            attempt += 1
+            renamed = f"{username}-{user_id}-{attempt}"
+        conn.execute("UPDATE users SET username = ? WHERE id = ?", (renamed, user_id))
+        logger.warning("Renamed duplicate user %d from %r to %r", user_id, username, renamed)
+
+
+# Triggers appending to the change log on every write to table. owner is
+# the column holding the user a row belongs to, None for rows anyone may see.
+def change_log_triggers(table, entity, owner=None):
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_changes_{op} AFTER {op.upper()} ON {table} BEGIN
+            INSERT INTO changes (entity, entity_id, op, user_id)
+            VALUES ('{entity}', {row}.id, '{op}', {f"{row}.{owner}" if owner else "NULL"});
+        END
+        """
+        for op, row in (("insert", "new"), ("update", "new"), ("delete", "old"))
+    ]
+
+
+# Numbered schema migrations. Each entry is applied once, inside its own
+# transaction, and recorded in the schema_version table. Append new
+# migrations to the end of the list; never edit one that has shipped.
+MIGRATIONS = [
+    (
+        1,
+        "Create base tables",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT NOT NULL,
+                password TEXT NOT NULL,
+                role TEXT NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS sections (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                created_at timestamp NOT NULL DEFAULT current_timestamp,
+                description TEXT NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS ebooks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                section_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                content TEXT NOT NULL,
+                author TEXT NOT NULL,
+                date_issued date NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS ebook_requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                ebook_id INTEGER NOT NULL,
+                request_date date NOT NULL,
+                return_date date NOT NULL,
+                status TEXT NOT NULL, -- e.g., 'requested', 'granted', 'returned', 'expired'
+                FOREIGN KEY (user_id) REFERENCES users(id),
+                FOREIGN KEY (ebook_id) REFERENCES ebooks(id)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS feedback (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                ebook_id INTEGER NOT NULL,
+                feedback TEXT NOT NULL,
+                feedback_date date NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users(id),
+                FOREIGN KEY (ebook_id) REFERENCES ebooks(id)
+            )
+            """,
+        ],
+    ),
+    (
+        2,
+        "Add indexes for the hot queries",
+        [
+            # Login and registration look users up by name
+            rename_duplicate_usernames,
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users (username)",
+            # Latest request status per (user, ebook), ordered by id
+            "CREATE INDEX IF NOT EXISTS idx_ebook_requests_user_ebook ON ebook_requests (user_id, ebook_id)",
+            # Open request count per user, user stats filtered by status
+            "CREATE INDEX IF NOT EXISTS idx_ebook_requests_user_status ON ebook_requests (user_id, status, return_date)",
+            # Active and overdue requests
+            "CREATE INDEX IF NOT EXISTS idx_ebook_requests_status_return ON ebook_requests (status, return_date)",
+            # Per-ebook request counts in the stats joins (covering)
+            "CREATE INDEX IF NOT EXISTS idx_ebook_requests_ebook_status ON ebook_requests (ebook_id, status)",
+            # Feedback given by a user, feedback overview per ebook (covering)
+            "CREATE INDEX IF NOT EXISTS idx_feedback_user_ebook ON feedback (user_id, ebook_id)",
+            "CREATE INDEX IF NOT EXISTS idx_feedback_ebook_date ON feedback (ebook_id, feedback_date)",
+            # Ebooks per section, recently added ebooks
+            "CREATE INDEX IF NOT EXISTS idx_ebooks_section ON ebooks (section_id)",
+            "CREATE INDEX IF NOT EXISTS idx_ebooks_date_issued ON ebooks (date_issued)",
+            "ANALYZE",
+        ],
+    ),
+    (
+        3,
+        "Index ebooks by author for listing filters",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_ebooks_author ON ebooks (author COLLATE NOCASE)",
+        ],
+    ),
+    (
+        4,
+        "Move ebook content to a compressed chunk store",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS ebook_content_chunks (
+                ebook_id INTEGER NOT NULL,
+                chunk_no INTEGER NOT NULL,
+                data BLOB NOT NULL, -- zlib-compressed UTF-8 text
+                PRIMARY KEY (ebook_id, chunk_no),
+                FOREIGN KEY (ebook_id) REFERENCES ebooks(id)
+            )
+            """,
+            "ALTER TABLE ebooks ADD COLUMN content_size INTEGER NOT NULL DEFAULT 0",
+            move_inline_content,
+        ],
+    ),
+    (
+        5,
+        "Add a full-text index over ebook name, author and content",
+        [
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS ebooks_fts USING fts5 (
+                name, author, content,
+                tokenize = 'porter unicode61'
+            )
+            """,
+            # Name and author follow the ebooks table; the content is written
+            # by content_store.write_content, which owns the book text.
+            """
+            CREATE TRIGGER IF NOT EXISTS ebooks_fts_insert AFTER INSERT ON ebooks BEGIN
+                INSERT INTO ebooks_fts (rowid, name, author, content)
+                VALUES (new.id, new.name, new.author, '');
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS ebooks_fts_update AFTER UPDATE OF name, author ON ebooks BEGIN
+                UPDATE ebooks_fts SET name = new.name, author = new.author
+                WHERE rowid = new.id;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS ebooks_fts_delete AFTER DELETE ON ebooks BEGIN
+                DELETE FROM ebooks_fts WHERE rowid = old.id;
+            END
+            """,
+            rebuild_search_index,
+        ],
+    ),
+    (
+        6,
+        "Add trigger-maintained aggregate tables for the dashboard",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS ebook_stats (
+                ebook_id INTEGER PRIMARY KEY,
+                request_count INTEGER NOT NULL DEFAULT 0,
+                borrow_count INTEGER NOT NULL DEFAULT 0, -- granted, returned or expired
+                feedback_count INTEGER NOT NULL DEFAULT 0,
+                last_feedback_date date
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS user_request_stats (
+                user_id INTEGER PRIMARY KEY,
+                total_requests INTEGER NOT NULL DEFAULT 0,
+                granted_requests INTEGER NOT NULL DEFAULT 0
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS section_stats (
+                section_id INTEGER PRIMARY KEY,
+                ebook_count INTEGER NOT NULL DEFAULT 0
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_ebook_stats_borrow ON ebook_stats (borrow_count)",
+            # Active and overdue lists are paginated by id within a status
+            "CREATE INDEX IF NOT EXISTS idx_ebook_requests_status ON ebook_requests (status)",
+            """
+            CREATE TRIGGER IF NOT EXISTS ebook_requests_stats_insert AFTER INSERT ON ebook_requests BEGIN
+                INSERT INTO ebook_stats (ebook_id, request_count, borrow_count)
+                VALUES (new.ebook_id, 1, new.status IN ('granted', 'returned', 'expired'))
+                ON CONFLICT (ebook_id) DO UPDATE SET
+                    request_count = request_count + 1,
+                    borrow_count = borrow_count + excluded.borrow_count;
+                INSERT INTO user_request_stats (user_id, total_requests, granted_requests)
+                VALUES (new.user_id, 1, new.status = 'granted')
+                ON CONFLICT (user_id) DO UPDATE SET
+                    total_requests = total_requests + 1,
+                    granted_requests = granted_requests + excluded.granted_requests;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS ebook_requests_stats_update AFTER UPDATE OF status ON ebook_requests
+            WHEN old.status IS NOT new.status BEGIN
+                UPDATE ebook_stats
+                SET borrow_count = borrow_count
+                    + (new.status IN ('granted', 'returned', 'expired'))
+                    - (old.status IN ('granted', 'returned', 'expired'))
+                WHERE ebook_id = new.ebook_id;
+                UPDATE user_request_stats
+                SET granted_requests = granted_requests + (new.status = 'granted') - (old.status = 'granted')
+                WHERE user_id = new.user_id;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS ebook_requests_stats_delete AFTER DELETE ON ebook_requests BEGIN
+                UPDATE ebook_stats
+                SET request_count = request_count - 1,
+                    borrow_count = borrow_count - (old.status IN ('granted', 'returned', 'expired'))
+                WHERE ebook_id = old.ebook_id;
+                UPDATE user_request_stats
+                SET total_requests = total_requests - 1,
+                    granted_requests = granted_requests - (old.status = 'granted')
+                WHERE user_id = old.user_id;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS feedback_stats_insert AFTER INSERT ON feedback BEGIN
+                INSERT INTO ebook_stats (ebook_id, feedback_count, last_feedback_date)
+                VALUES (new.ebook_id, 1, new.feedback_date)
+                ON CONFLICT (ebook_id) DO UPDATE SET
+                    feedback_count = feedback_count + 1,
+                    last_feedback_date = MAX(COALESCE(last_feedback_date, ''), excluded.last_feedback_date);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS feedback_stats_delete AFTER DELETE ON feedback BEGIN
+                UPDATE ebook_stats
+                SET feedback_count = feedback_count - 1,
+                    last_feedback_date = (
+                        SELECT MAX(feedback_date) FROM feedback WHERE ebook_id = old.ebook_id
+                    )
+                WHERE ebook_id = old.ebook_id;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS ebooks_stats_insert AFTER INSERT ON ebooks BEGIN
+                INSERT INTO section_stats (section_id, ebook_count)
+                VALUES (new.section_id, 1)
+                ON CONFLICT (section_id) DO UPDATE SET ebook_count = ebook_count + 1;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS ebooks_stats_update AFTER UPDATE OF section_id ON ebooks
+            WHEN old.section_id IS NOT new.section_id BEGIN
+                UPDATE section_stats SET ebook_count = ebook_count - 1
+                WHERE section_id = old.section_id;
+                INSERT INTO section_stats (section_id, ebook_count)
+                VALUES (new.section_id, 1)
+                ON CONFLICT (section_id) DO UPDATE SET ebook_count = ebook_count + 1;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS ebooks_stats_delete AFTER DELETE ON ebooks BEGIN
+                UPDATE section_stats SET ebook_count = ebook_count - 1
+                WHERE section_id = old.section_id;
+            END
+            """,
+            rebuild_aggregates,
+        ],
+    ),
+    (
+        7,
+        "Add a change log of catalog, request and feedback writes",
+        [
+            # Append-only; id is the cursor clients sync from (see changes.py)
+            """
+            CREATE TABLE IF NOT EXISTS changes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                entity TEXT NOT NULL, -- 'ebook', 'section', 'ebook_request' or 'feedback'
+                entity_id INTEGER NOT NULL,
+                op TEXT NOT NULL, -- 'insert', 'update' or 'delete'
+                user_id INTEGER, -- owner of the row, NULL when anyone may see it
+                changed_at timestamp NOT NULL DEFAULT current_timestamp
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_changes_entity ON changes (entity, entity_id, id)",
+            "CREATE INDEX IF NOT EXISTS idx_changes_changed_at ON changes (changed_at)",
+            # Highest id removed by retention; older cursors can't be synced
+            """
+            CREATE TABLE IF NOT EXISTS changes_horizon (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                pruned_through INTEGER NOT NULL
+            )
+            """,
+            "INSERT OR IGNORE INTO changes_horizon (id, pruned_through) VALUES (1, 0)",
+            *change_log_triggers("ebooks", "ebook"),
+            *change_log_triggers("sections", "section"),
+            *change_log_triggers("ebook_requests", "ebook_request", "user_id"),
+            *change_log_triggers("feedback", "feedback", "user_id"),
+        ],
+    ),
+    (
+        8,
+        "Index only the start of ebook content for search",
+        [
+            rebuild_search_index,
+        ],
+    ),
+    (
+        9,
+        "Drop the dashboard counters of deleted ebooks",
+        [
+            """
+            CREATE TRIGGER IF NOT EXISTS ebooks_stats_delete_counters AFTER DELETE ON ebooks BEGIN
+                DELETE FROM ebook_stats WHERE ebook_id = old.id;
+            END
+            """,
+            "DELETE FROM ebook_stats WHERE ebook_id NOT IN (SELECT id FROM ebooks)",
+        ],
+    ),
+    (
+        10,
+        "Index ebook request counts for the top requested list",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_ebook_stats_request ON ebook_stats (request_count)",
+        ],
+    ),
+]
+
+
+def ensure_version_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at timestamp NOT NULL DEFAULT current_timestamp
+        )
+    """)
+
+
+# Highest applied migration, 0 for a fresh database
+def current_version(conn):
+    ensure_version_table(conn)
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+# Apply every pending migration up to target (default: latest)
+def migrate(conn, target=None, verbose=False):
+    version = current_version(conn)
+    applied = []
+    for number, description, statements in MIGRATIONS:
+        if number <= version or (target is not None and number > target):
+            continue
+        started = time.perf_counter()
+        conn.execute("BEGIN")
+        try:
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (number, description),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if verbose:
+            elapsed = (time.perf_counter() - started) * 1000
+            print(f"Applied migration {number}: {description} ({elapsed:.1f} ms)")
+        applied.append(number)
+    return applied
+
+
+if __name__ == "__main__":
+    from db import get_db_connection
+
+    parser = argparse.ArgumentParser(description="Apply database schema migrations")
+    parser.add_argument("--target", type=int, help="migrate up to this version only")
+    parser.add_argument("--status", action="store_true", help="show the schema version and exit")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    if args.status:
+        print(f"Schema version {current_version(conn)} (latest {MIGRATIONS[-1][0]})")
+    else:
+        applied = migrate(conn, target=args.target, verbose=True)
+        if not applied:
+            print("Database is up to date.")
+    conn.close()
@@ -0,0 +1,101 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Hash parameters in werkzeug's method syntax, e.g. "scrypt:32768:8:1" or
+# "pbkdf2:sha256:600000". Stored hashes made with other parameters are
+# upgraded the next time their owner logs in.
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD") or "scrypt"
+PASSWORD_SALT_LENGTH = int(os.getenv("PASSWORD_SALT_LENGTH") or 16)
+
+# Hashes run on a small pool so a login burst can't take every request
+# thread. Requests wait at most HASH_ADMISSION_TIMEOUT seconds for one of
+# HASH_MAX_PENDING slots (running or queued) and are turned away after that.
+HASH_WORKERS = int(os.getenv("HASH_WORKERS") or os.cpu_count() or 1)
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING") or HASH_WORKERS * 4)
+HASH_ADMISSION_TIMEOUT = float(os.getenv("HASH_ADMISSION_TIMEOUT") or 2)
+
+
+# Raised when the hash pool is saturated
+class HashPoolBusy(Exception):
+    pass
+
+
+# Bounded pool for password hashing. hashlib's scrypt and pbkdf2 release
+# the GIL, so worker threads hash in parallel with request handling.
+class HashPool:
+    def __init__(self, workers, max_pending, admission_timeout):
+        self.workers = workers
+        self.admission_timeout = admission_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.counters = {"completed": 0, "failed": 0, "rejected": 0, "rehashed": 0}
+
+    def _get_executor(self):
+        # Worker threads don't survive a fork, start a new pool in the child
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="password-hash")
+                self._pid = os.getpid()
+            return self._executor
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.admission_timeout):
+            self.count("rejected")
+            raise HashPoolBusy()
+        try:
+            result = self._get_executor().submit(fn, *args).result()
+        except Exception:
+            self.count("failed")
+            raise
+        finally:
+            self._slots.release()
+        self.count("completed")
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {"workers": self.workers, "method": configured_method(), **self.counters}
+
+
+hash_pool = HashPool(HASH_WORKERS, HASH_MAX_PENDING, HASH_ADMISSION_TIMEOUT)
+
+
+# The configured method with werkzeug's defaults filled in, as it appears
+# in stored hashes
+@lru_cache(maxsize=None)
+def configured_method():
+    return generate_password_hash("", PASSWORD_HASH_METHOD, 1).split("$", 1)[0]
+
+
+def hash_password(password):
+    return hash_pool.run(generate_password_hash, password, PASSWORD_HASH_METHOD, PASSWORD_SALT_LENGTH)
+
+
+def verify_password(stored_hash, password):
+    return hash_pool.run(check_password_hash, stored_hash, password)
+
+
+# Whether a stored hash was made with other parameters than the current ones
+def needs_rehash(stored_hash):
+    return stored_hash.split("$", 1)[0] != configured_method()
+
+
+# Check a user's password and upgrade its hash if the parameters changed.
+# Returns False on a wrong password; raises HashPoolBusy when saturated.
+def check_and_upgrade(conn, user, password):
+    if not verify_password(user["password"], password):
+        return False
+    if needs_rehash(user["password"]):
+        conn.execute("UPDATE users SET password = ? WHERE id = ?", (hash_password(password), user["id"]))
+        conn.commit()
+        hash_pool.count("rehashed")
+    return True
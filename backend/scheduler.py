@@ -0,0 +1,136 @@
+import argparse
+import os
+import threading
+import time
+from db import get_db_connection
+from cache import invalidate
+from changes import CHANGES_MAINTENANCE_INTERVAL_SECONDS, maintain_change_log
+
+EXPIRE_INTERVAL_SECONDS = int(os.getenv("EXPIRE_INTERVAL_SECONDS") or 300)
+EXPIRE_BATCH_SIZE = int(os.getenv("EXPIRE_BATCH_SIZE") or 500)
+
+
+# Move granted requests past their return date to 'expired', one batch per
+# transaction so writers are never blocked for long. Returns the number of
+# requests expired.
+def expire_overdue_requests(batch_size=EXPIRE_BATCH_SIZE):
+    conn = get_db_connection()
+    expired = 0
+    users = set()
+    try:
+        while True:
+            rows = conn.execute(
+                """
+                UPDATE ebook_requests
+                SET status = 'expired'
+                WHERE id IN (
+                    SELECT id FROM ebook_requests
+                    WHERE status = 'granted' AND return_date < DATE('now')
+                    LIMIT ?
+                )
+                RETURNING user_id
+            """,
+                (batch_size,),
+            ).fetchall()
+            conn.commit()
+            expired += len(rows)
+            users.update(row["user_id"] for row in rows)
+            if len(rows) < batch_size:
+                break
+    finally:
+        conn.close()
+
+    # Invalidate the caches that show request statuses, once per run
+    if expired:
+        invalidate("table:ebook_requests", *(f"user:{user_id}" for user_id in users))
+    return expired
+
+
+# Runs registered jobs at fixed intervals on a daemon thread and keeps
+# per-job metrics for monitoring
+class Scheduler:
+    def __init__(self):
+        self.jobs = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._app = None
+
+    def add_job(self, name, func, interval):
+        self.jobs[name] = {
+            "func": func,
+            "interval": interval,
+            "next_run": time.monotonic(),
+            "runs": 0,
+            "errors": 0,
+            "last_run": None,
+            "last_duration_ms": None,
+            "last_result": None,
+            "total_result": 0,
+        }
+
+    def run_job(self, name):
+        job = self.jobs[name]
+        started = time.perf_counter()
+        try:
+            with self._app.app_context():
+                result = job["func"]()
+        except Exception:
+            job["errors"] += 1
+            self._app.logger.exception("Scheduled job %s failed", name)
+            result = None
+        job["runs"] += 1
+        job["last_run"] = time.time()
+        job["last_duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        job["last_result"] = result
+        job["total_result"] += result or 0
+        job["next_run"] = time.monotonic() + job["interval"]
+
+    def _loop(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for name, job in self.jobs.items():
+                if job["next_run"] <= now:
+                    self.run_job(name)
+            next_run = min((job["next_run"] for job in self.jobs.values()), default=now + 1)
+            self._stop.wait(max(next_run - time.monotonic(), 0.1))
+
+    def start(self, app):
+        self._app = app
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        return {
+            name: {key: value for key, value in job.items() if key != "func"}
+            for name, job in self.jobs.items()
+        }
+
+
+scheduler = Scheduler()
+scheduler.add_job("expire_overdue_requests", expire_overdue_requests, EXPIRE_INTERVAL_SECONDS)
+scheduler.add_job("maintain_change_log", maintain_change_log, CHANGES_MAINTENANCE_INTERVAL_SECONDS)
+
+
+if __name__ == "__main__":
+    # Run the jobs once, e.g. from cron or a separate worker
+    from app import create_app
+    app = create_app({"SCHEDULER_ENABLED": False})
+
+    parser = argparse.ArgumentParser(description="Run scheduled jobs once")
+    parser.add_argument("--batch-size", type=int, default=EXPIRE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    with app.app_context():
+        started = time.perf_counter()
+        expired = expire_overdue_requests(args.batch_size)
+        elapsed = (time.perf_counter() - started) * 1000
+    print(f"Expired {expired} overdue requests in {elapsed:.1f} ms")
@@ -0,0 +1,72 @@
+import html
+from flask import Blueprint, request, jsonify
+from db import get_db_connection
+
+search_bp = Blueprint("search", __name__)
+
+MAX_PAGE_SIZE = 100
+
+# Relative weight of name, author and content matches in the ranking
+BM25_WEIGHTS = (10.0, 5.0, 1.0)
+
+
+# Markers snippet() puts around matches. They are swapped for <mark> tags
+# after the ebook text is HTML-escaped; marker characters occurring in a
+# book itself can only produce stray <mark> tags, never other markup.
+MATCH_START, MATCH_END = "\x02", "\x03"
+
+
+def highlight(snippet):
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(MATCH_START, "<mark>").replace(MATCH_END, "</mark>")
+
+
+# Turn free text into an FTS5 query: every term quoted so user input can't
+# inject query syntax, and the last term matched as a prefix.
+def build_match_query(text):
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    if not terms:
+        return None
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+# Search ebooks by name, author and the start of their content, best
+# matches first
+@search_bp.route("/ebooks/search", methods=["GET"])
+def search_ebooks():
+    match = build_match_query(request.args.get("q", ""))
+    if match is None:
+        return jsonify({"message": "Search query is required!"}), 400
+
+    limit = min(request.args.get("limit", 20, type=int), MAX_PAGE_SIZE)
+    offset = request.args.get("offset", 0, type=int)
+    if limit < 1 or offset < 0:
+        return jsonify({"message": "Invalid pagination parameters!"}), 400
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT ebooks.id, ebooks.section_id, ebooks.name, ebooks.author, ebooks.date_issued,
+               snippet(ebooks_fts, -1, ?, ?, '...', 16) AS snippet,
+               bm25(ebooks_fts, ?, ?, ?) AS rank
+        FROM ebooks_fts
+        JOIN ebooks ON ebooks.id = ebooks_fts.rowid
+        WHERE ebooks_fts MATCH ?
+        ORDER BY rank
+        LIMIT ? OFFSET ?
+        """,
+        (MATCH_START, MATCH_END, *BM25_WEIGHTS, match, limit + 1, offset),
+    )
+    results = cursor.fetchall()
+    conn.close()
+
+    # The snippet is HTML: escaped ebook text with the matches in <mark>
+    response = jsonify([
+        {**dict(result), "snippet": highlight(result["snippet"])} for result in results[:limit]
+    ])
+    if len(results) > limit:
+        response.headers["X-Next-Offset"] = str(offset + limit)
+    return response
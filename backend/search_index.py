@@ -0,0 +1,41 @@
+import argparse
+from content_store import read_contents, search_text
+
+
+# Rebuild the full-text index from the ebooks table and the content store
+def rebuild_search_index(conn, batch_size=500):
+    conn.execute("DELETE FROM ebooks_fts")
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, name, author FROM ebooks WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, batch_size),
+        ).fetchall()
+        if not rows:
+            break
+        contents = read_contents(conn, [row[0] for row in rows])
+        conn.executemany(
+            "INSERT INTO ebooks_fts (rowid, name, author, content) VALUES (?, ?, ?, ?)",
+            ((row[0], row[1], row[2], search_text(contents[row[0]])) for row in rows),
+        )
+        last_id = rows[-1][0]
+    conn.execute("INSERT INTO ebooks_fts (ebooks_fts) VALUES ('optimize')")
+
+
+if __name__ == "__main__":
+    from db import get_db_connection
+
+    parser = argparse.ArgumentParser(description="Maintain the ebook full-text index")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the index from scratch")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        conn = get_db_connection()
+        conn.execute("BEGIN")
+        rebuild_search_index(conn)
+        conn.commit()
+        count = conn.execute("SELECT COUNT(*) FROM ebooks_fts").fetchone()[0]
+        conn.close()
+        print(f"Indexed {count} ebooks.")
+    else:
+        parser.print_help()
@@ -1,7 +1,8 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from db import get_db_connection
-from cache import cache
+from cache import cached_by_tags, invalidate
+from etags import conditional
 from users import is_librarian
 
 sections_bp = Blueprint("sections", __name__)
@@ -48,14 +49,15 @@ def create_section():
     conn.close()
 
     # Invalidate the cache for all sections
-    cache.delete("sections")
+    invalidate("table:sections")
 
     return jsonify({"message": "Section created successfully!"}), 201
 
 
 # Get all sections
 @sections_bp.route("/sections", methods=["GET"])
-@cache.cached(timeout=60, key_prefix="sections")
+@conditional(lambda: ["table:sections"])
+@cached_by_tags(lambda: ["table:sections"])
 def get_sections():
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -69,6 +71,8 @@ def get_sections():
 
 # Get a section by ID
 @sections_bp.route("/sections/<int:id>", methods=["GET"])
+@conditional(lambda id: [f"section:{id}"])
+@cached_by_tags(lambda id: [f"section:{id}"])
 def get_section(id):
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -118,7 +122,7 @@ def update_section(id):
     conn.close()
 
     # Invalidate the cache for the updated section
-    cache.delete("sections")
+    invalidate("table:sections", f"section:{id}")
 
     return jsonify({"message": "Section updated successfully!"})
 
@@ -143,6 +147,6 @@ def delete_section(id):
     conn.close()
 
     # Invalidate the cache for the deleted section
-    cache.delete("sections")
+    invalidate("table:sections", f"section:{id}")
 
     return jsonify({"message": "Section deleted successfully!"})
@@ -1,10 +1,10 @@
 from db import get_db_connection, init_db
+from imports import import_ebooks, import_sections
 from datetime import datetime
 
 def seed_sections():
     # Connect to the SQLite database
     conn = get_db_connection()
-    cursor = conn.cursor()
 
     # Dummy data to insert
     dummy_data = [
@@ -15,18 +15,13 @@ def seed_sections():
         ("Biography", "Books that provide an account of a person's life."),
     ]
 
-    # Insert dummy data into the sections table
-    for name, description in dummy_data:
-        cursor.execute(
-            """
-            INSERT INTO sections (name, description, created_at)
-            VALUES (?, ?, ?)
-            """,
-            (name, description, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-        )
-
-    # Commit the transaction and close the connection
-    conn.commit()
+    # Insert dummy data into the sections table in one batch
+    created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    records = (
+        (line, {"name": name, "description": description, "created_at": created_at})
+        for line, (name, description) in enumerate(dummy_data, start=1)
+    )
+    import_sections(conn, records)
     conn.close()
 
     print("Sections data inserted successfully!")
@@ -34,7 +29,6 @@ def seed_sections():
 def seed_ebooks():
     # Connect to the SQLite database
     conn = get_db_connection()
-    cursor = conn.cursor()
 
     # Dummy data to insert
     dummy_ebooks = [
@@ -65,20 +59,17 @@ def seed_ebooks():
         (5, "The Autobiography of Malcolm X", "A biography by Malcolm X and Alex Haley.", "Malcolm X and Alex Haley", datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
     ]
 
-    # Insert dummy data into the ebooks table
-    for section_id, name, content, author, date_issued in dummy_ebooks:
-        cursor.execute(
-            """
-            INSERT INTO ebooks (section_id, name, content, author, date_issued)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (section_id, name, content, author, date_issued)
-        )
-
-    # Commit the transaction and close the connection
-    conn.commit()
+    # Insert dummy data into the ebooks table and the content store in one batch
+    records = (
+        (line, {"section_id": section_id, "name": name, "content": content, "author": author, "date_issued": date_issued})
+        for line, (section_id, name, content, author, date_issued) in enumerate(dummy_ebooks, start=1)
+    )
+    report = import_ebooks(conn, records)
     conn.close()
 
+    for error in report.errors:
+        print(f"Ebook {error['line']} not inserted: {error['error']}")
+
     print("Ebooks data inserted successfully!")
 
 # Call the functions to seed the database
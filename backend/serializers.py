@@ -0,0 +1,49 @@
+import orjson
+from flask import Response, request
+
+try:
+    import msgpack
+except ImportError:  # optional, only needed for ?format=msgpack
+    msgpack = None
+
+# Response formats for row lists, picked with ?format=:
+#   json      a list of objects (the default)
+#   columnar  {"columns": [...], "rows": [[...], ...]}, column names once
+#   msgpack   the columnar layout encoded as MessagePack, if msgpack is installed
+ROW_FORMATS = ("json", "columnar") + (("msgpack",) if msgpack is not None else ())
+
+
+# The format asked for, raising ValueError for an unknown or unavailable one
+def requested_format():
+    fmt = request.args.get("format") or "json"
+    if fmt not in ROW_FORMATS:
+        raise ValueError(f"unsupported format {fmt}")
+    return fmt
+
+
+# Run a query and return its column names and rows as plain tuples, which
+# are cheaper to build than sqlite3.Row objects and serialize directly
+def fetch_rows(conn, query, params=()):
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(query, params)
+    columns = [column[0] for column in cursor.description]
+    return columns, cursor.fetchall()
+
+
+# Rows laid out for a format: objects for json, shared column names otherwise
+def rows_payload(columns, rows, fmt):
+    if fmt == "json":
+        return [dict(zip(columns, row)) for row in rows]
+    return {"columns": columns, "rows": rows}
+
+
+# Encode a payload built from rows_payload (or a dict of them)
+def encode_response(payload, fmt, status=200):
+    if fmt == "msgpack":
+        return Response(msgpack.packb(payload), status=status, mimetype="application/msgpack")
+    return Response(orjson.dumps(payload), status=status, mimetype="application/json")
+
+
+def rows_response(columns, rows, fmt, status=200):
+    return encode_response(rows_payload(columns, rows, fmt), fmt, status)
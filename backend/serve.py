@@ -0,0 +1,210 @@
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer
+from app import create_app
+from db import pool
+from scheduler import scheduler
+from write_queue import write_queue
+
+# Production server: a master process that prepares the database, opens the
+# listening socket and forks worker processes, each serving requests from a
+# fixed pool of threads.
+SERVER_HOST = os.getenv("SERVER_HOST") or "0.0.0.0"
+SERVER_PORT = int(os.getenv("SERVER_PORT") or 5000)
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS") or os.cpu_count() or 1)
+SERVER_THREADS = int(os.getenv("SERVER_THREADS") or 8)
+# Accepted connections allowed to wait for a free thread; beyond that new
+# connections get a 503 right away
+SERVER_MAX_PENDING = int(os.getenv("SERVER_MAX_PENDING") or 64)
+# Seconds workers get to finish in-flight requests on shutdown
+GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT") or 30)
+# Comma separated GET paths requested by each worker before it starts serving
+WARMUP_PATHS = os.getenv("WARMUP_PATHS", "/ebooks?limit=50,/sections")
+
+logger = logging.getLogger("serve")
+
+
+BUSY_BODY = b'{"message":"The library is busy, please try again!"}\n'
+BUSY_RESPONSE = (
+    b"HTTP/1.0 503 SERVICE UNAVAILABLE\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Content-Length: " + str(len(BUSY_BODY)).encode() + b"\r\n"
+    b"Retry-After: 1\r\n"
+    b"Connection: close\r\n\r\n" + BUSY_BODY
+)
+
+
+# A WSGI server handing connections to a bounded thread pool with a bounded
+# backlog
+class PooledWSGIServer(BaseWSGIServer):
+    def __init__(self, host, port, app, threads, fd, max_pending=SERVER_MAX_PENDING):
+        super().__init__(host, port, app, fd=fd)
+        # Set after __init__ so responses stay HTTP/1.0: a kept-alive idle
+        # connection would otherwise hold one of the pool's threads
+        self.multithread = True
+        self.multiprocess = True
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="request")
+        self.slots = threading.BoundedSemaphore(threads + max_pending)
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            self._reject(request)
+            return
+        self.executor.submit(self._handle, request, client_address)
+
+    # Answer without reading the request, so a full server stays cheap to
+    # turn away
+    def _reject(self, request):
+        try:
+            request.sendall(BUSY_RESPONSE)
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(request)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    # Wait for accepted requests to finish
+    def drain(self):
+        self.executor.shutdown(wait=True)
+
+
+# Fill the worker's in-process cache with the hot listings
+def warm_caches(app, paths):
+    client = app.test_client()
+    for path in paths:
+        started = time.perf_counter()
+        try:
+            status = client.get(path).status_code
+        except Exception:
+            logger.exception("Warming %s failed", path)
+            continue
+        logger.info("Warmed %s (%s) in %.1f ms", path, status, (time.perf_counter() - started) * 1000)
+
+
+def run_worker(app, index, fd, threads, warmup):
+    # Nothing the master opened is used here: the pool and the cache notice
+    # the new pid and start over, the scheduler and hash pool start lazily
+    pool.reset()
+    server = PooledWSGIServer(SERVER_HOST, SERVER_PORT, app, threads, fd)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever, so it can't run on this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    warm_caches(app, warmup)
+    # A single worker runs the background jobs
+    if index == 0:
+        scheduler.start(app)
+
+    logger.info("Worker %d (pid %d) serving with %d threads", index, os.getpid(), threads)
+    server.serve_forever()
+
+    scheduler.stop()
+    server.drain()
+    # Commit writes still waiting for a group commit
+    write_queue.stop()
+    pool.reset()
+    logger.info("Worker %d (pid %d) stopped", index, os.getpid())
+
+
+def spawn(app, index, fd, threads, warmup):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(app, index, fd, threads, warmup)
+        except Exception:
+            logger.exception("Worker %d failed", index)
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def serve(workers, threads, warmup):
+    # Schema migrations run once, here, before any worker exists
+    app = create_app({"SCHEDULER_ENABLED": False})
+    pool.reset()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((SERVER_HOST, SERVER_PORT))
+    sock.listen(128)
+    fd = sock.fileno()
+    # Without Redis every worker has its own cache and invalidation
+    # generations, so a write in one worker would leave the others serving
+    # stale data and ETags
+    if workers > 1 and not (app.config["CACHE_REDIS_HOST"] or app.config["CACHE_REDIS_URL"]):
+        logger.warning("Redis is not configured, running 1 worker instead of %d", workers)
+        workers = 1
+    logger.info("Listening on %s:%d with %d workers", SERVER_HOST, SERVER_PORT, workers)
+
+    children = {spawn(app, index, fd, threads, warmup): index for index in range(workers)}
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Replace workers that die until asked to stop
+    while not stopping.is_set():
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            stopping.wait(0.5)
+            continue
+        index = children.pop(pid, None)
+        if index is not None and not stopping.is_set():
+            logger.warning("Worker %d (pid %d) exited with %d, restarting", index, pid, status)
+            stopping.wait(1)
+            children[spawn(app, index, fd, threads, warmup)] = index
+
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + GRACEFUL_TIMEOUT
+    while children and time.monotonic() < deadline:
+        pid, _ = os.waitpid(-1, os.WNOHANG)
+        if pid:
+            children.pop(pid, None)
+        else:
+            time.sleep(0.1)
+    for pid in children:
+        logger.warning("Worker pid %d did not stop in time, killing it", pid)
+        os.kill(pid, signal.SIGKILL)
+    sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the API with multiple worker processes")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    parser.add_argument("--threads", type=int, default=SERVER_THREADS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(message)s")
+    serve(args.workers, args.threads, [path for path in WARMUP_PATHS.split(",") if path])
+    sys.exit(0)
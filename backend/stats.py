@@ -1,20 +1,61 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, request, jsonify
 from flask_jwt_extended import get_jwt_identity, jwt_required
 from db import get_db_connection
+from cache import cache, cached_by_tags, tagged_key
+from serializers import encode_response, fetch_rows, requested_format, rows_payload
 from users import UserIdentity, is_librarian, is_user
 
 stats_bp = Blueprint("stats", __name__)
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+# Run a query and lay its rows out for the requested format
+def query_rows(conn, fmt, query, params=()):
+    return rows_payload(*fetch_rows(conn, query, params), fmt)
+
+
+# Run a keyset-paginated query (params: cursor, limit) and return the page
+# laid out for the format plus the cursor of the next page, if any
+def paginate(conn, fmt, query, cursor, limit):
+    columns, rows = fetch_rows(conn, query, (cursor, limit + 1))
+    next_cursor = rows[limit - 1][columns.index('id')] if len(rows) > limit else None
+    return rows_payload(columns, rows[:limit], fmt), next_cursor
+
+
+# Tables the librarian dashboard is built from
+LIBRARIAN_STATS_TAGS = ['table:ebooks', 'table:sections', 'table:ebook_requests', 'table:feedback', 'table:users']
+
+
+# Cache tags for the librarian dashboard. Entries are kept per caller so a
+# non-librarian never gets a cached dashboard before the role check runs.
+def librarian_stats_tags():
+    return LIBRARIAN_STATS_TAGS + [f"user:{get_jwt_identity()['id']}"]
+
+
 # Function to retrieve statistics for the librarian (admin)
 @stats_bp.route('/stats/librarian', methods=['GET'])
 @jwt_required()
+@cached_by_tags(librarian_stats_tags)
 def librarian_stats():    
     current_user: UserIdentity = get_jwt_identity()
 
     if not is_librarian(current_user):
         return jsonify({"message": "You are not a librarian"}), 403
     
-    print(f"{current_user=}")
+    # Per-ebook, per-user and request lists are paginated by id
+    limit = min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE)
+    ebook_cursor = request.args.get('ebook_cursor', 0, type=int)
+    user_cursor = request.args.get('user_cursor', 0, type=int)
+    active_cursor = request.args.get('active_cursor', 0, type=int)
+    overdue_cursor = request.args.get('overdue_cursor', 0, type=int)
+    try:
+        fmt = requested_format()
+    except ValueError:
+        return jsonify({"message": "Invalid format parameter!"}), 400
+    if limit < 1:
+        return jsonify({"message": "Invalid pagination parameters!"}), 400
     
     conn = get_db_connection()
 
@@ -25,158 +66,190 @@ def librarian_stats():
     total_sections = conn.execute('SELECT COUNT(*) FROM sections').fetchone()['COUNT(*)']
 
     # Ebook Activity
-    ebook_activity = conn.execute('''
-        SELECT ebooks.name, 
-               COUNT(ebook_requests.id) AS request_count 
+    ebook_activity, ebook_next_cursor = paginate(conn, fmt, '''
+        SELECT ebooks.id, 
+               ebooks.name, 
+               COALESCE(ebook_stats.request_count, 0) AS request_count 
         FROM ebooks 
-        LEFT JOIN ebook_requests ON ebooks.id = ebook_requests.ebook_id 
-        GROUP BY ebooks.name
-    ''').fetchall()
+        LEFT JOIN ebook_stats ON ebooks.id = ebook_stats.ebook_id 
+        WHERE ebooks.id > ? 
+        ORDER BY ebooks.id 
+        LIMIT ?
+    ''', ebook_cursor, limit)
 
     # Top Borrowed Ebooks
-    top_borrowed_ebooks = conn.execute('''
+    top_borrowed_ebooks = query_rows(conn, fmt, '''
         SELECT ebooks.name, 
-               COUNT(ebook_requests.id) AS borrow_count 
-        FROM ebooks 
-        LEFT JOIN ebook_requests ON ebooks.id = ebook_requests.ebook_id 
-        GROUP BY ebooks.name 
-        ORDER BY borrow_count DESC 
+               ebook_stats.borrow_count 
+        FROM ebook_stats 
+        JOIN ebooks ON ebooks.id = ebook_stats.ebook_id 
+        ORDER BY ebook_stats.borrow_count DESC 
         LIMIT 5
-    ''').fetchall()
+    ''')
 
     # Active Ebook Requests
-    active_requests = conn.execute('''
-        SELECT * FROM ebook_requests WHERE status = "granted"
-    ''').fetchall()
+    active_requests, active_next_cursor = paginate(conn, fmt, '''
+        SELECT * FROM ebook_requests 
+        WHERE status = "granted" AND id > ? 
+        ORDER BY id 
+        LIMIT ?
+    ''', active_cursor, limit)
 
     # Overdue Ebook Requests
-    overdue_requests = conn.execute('''
+    overdue_requests, overdue_next_cursor = paginate(conn, fmt, '''
         SELECT * FROM ebook_requests 
-        WHERE status = "granted" AND return_date < DATE('now')
-    ''').fetchall()
+        WHERE status = "expired" AND id > ? 
+        ORDER BY id 
+        LIMIT ?
+    ''', overdue_cursor, limit)
 
     # User Activity
-    user_activity = conn.execute('''
-        SELECT users.username, 
-               COUNT(ebook_requests.id) AS total_requests, 
-               SUM(CASE WHEN ebook_requests.status = 'granted' THEN 1 ELSE 0 END) AS granted_requests 
+    user_activity, user_next_cursor = paginate(conn, fmt, '''
+        SELECT users.id, 
+               users.username, 
+               COALESCE(user_request_stats.total_requests, 0) AS total_requests, 
+               COALESCE(user_request_stats.granted_requests, 0) AS granted_requests 
         FROM users 
-        LEFT JOIN ebook_requests ON users.id = ebook_requests.user_id 
-        GROUP BY users.username
-    ''').fetchall()
+        LEFT JOIN user_request_stats ON users.id = user_request_stats.user_id 
+        WHERE users.id > ? 
+        ORDER BY users.id 
+        LIMIT ?
+    ''', user_cursor, limit)
 
     # Feedback Overview
-    feedback_overview = conn.execute('''
+    feedback_overview = query_rows(conn, fmt, '''
         SELECT ebooks.name, 
-               COUNT(feedback.id) AS feedback_count, 
-               MAX(feedback.feedback_date) AS last_feedback_date 
-        FROM feedback 
-        LEFT JOIN ebooks ON feedback.ebook_id = ebooks.id 
-        GROUP BY ebooks.name
-    ''').fetchall()
+               ebook_stats.feedback_count, 
+               ebook_stats.last_feedback_date 
+        FROM ebook_stats 
+        JOIN ebooks ON ebook_stats.ebook_id = ebooks.id 
+        WHERE ebook_stats.feedback_count > 0 
+        ORDER BY ebooks.name
+    ''')
 
     # Ebooks by Section
-    ebooks_by_section = conn.execute('''
+    ebooks_by_section = query_rows(conn, fmt, '''
         SELECT sections.name AS section_name, 
-               COUNT(ebooks.id) AS ebook_count 
+               COALESCE(section_stats.ebook_count, 0) AS ebook_count 
         FROM sections 
-        LEFT JOIN ebooks ON sections.id = ebooks.section_id 
-        GROUP BY sections.name
-    ''').fetchall()
+        LEFT JOIN section_stats ON sections.id = section_stats.section_id 
+        ORDER BY sections.name
+    ''')
 
     conn.close()
 
-    return jsonify({
+    return encode_response({
         'total_ebooks': total_ebooks,
         'total_sections': total_sections,
-        'ebook_activity': [dict(row) for row in ebook_activity],
-        'top_borrowed_ebooks': [dict(row) for row in top_borrowed_ebooks],
-        'active_requests': [dict(row) for row in active_requests],
-        'overdue_requests': [dict(row) for row in overdue_requests],
-        'user_activity': [dict(row) for row in user_activity],
-        'feedback_overview': [dict(row) for row in feedback_overview],
-        'ebooks_by_section': [dict(row) for row in ebooks_by_section]
-    })
-
-# Function to retrieve statistics for the user
-@stats_bp.route('/stats/user', methods=['GET'])
-@jwt_required()
-def user_stats():
-    current_user: UserIdentity = get_jwt_identity()
-
-    if not is_user(current_user):
-        return jsonify({"message": "You are not a user"}), 403
-    
-    user_id = current_user['id']
-    
-    conn = get_db_connection()
-
-    # Borrowing History
-    borrowing_history = conn.execute('''
+        'ebook_activity': ebook_activity,
+        'ebook_activity_next_cursor': ebook_next_cursor,
+        'top_borrowed_ebooks': top_borrowed_ebooks,
+        'active_requests': active_requests,
+        'active_requests_next_cursor': active_next_cursor,
+        'overdue_requests': overdue_requests,
+        'overdue_requests_next_cursor': overdue_next_cursor,
+        'user_activity': user_activity,
+        'user_activity_next_cursor': user_next_cursor,
+        'feedback_overview': feedback_overview,
+        'ebooks_by_section': ebooks_by_section
+    }, fmt)
+
+# Per-user dashboards are kept until the user's requests or feedback (or
+# the catalog) change; the parts shared by every user are refreshed on a
+# timer, as they move with everyone's requests
+USER_STATS_TIMEOUT = 300
+SHARED_USER_STATS_TIMEOUT = 60
+
+
+# The user's own dashboard sections as {name: (columns, rows)}. History,
+# active and overdue requests all come from one scan of their requests.
+def user_dashboard(conn, user_id):
+    key = tagged_key('stats:user', ['table:ebooks', f'user:{user_id}'])
+    dashboard = cache.get(key)
+    if dashboard is not None:
+        return dashboard
+
+    requests = conn.execute('''
         SELECT ebooks.name, 
                ebook_requests.request_date, 
-               ebook_requests.return_date 
-        FROM ebooks 
-        JOIN ebook_requests ON ebooks.id = ebook_requests.ebook_id 
+               ebook_requests.return_date, 
+               ebook_requests.status 
+        FROM ebook_requests 
+        JOIN ebooks ON ebooks.id = ebook_requests.ebook_id 
         WHERE ebook_requests.user_id = ? 
     ''', (user_id,)).fetchall()
 
-    # Current Active Requests
-    active_requests = conn.execute('''
-        SELECT ebooks.name, 
-               ebook_requests.request_date, 
-               ebook_requests.return_date 
-        FROM ebooks 
-        JOIN ebook_requests ON ebooks.id = ebook_requests.ebook_id 
-        WHERE ebook_requests.user_id = ? AND ebook_requests.status = "granted"
-    ''', (user_id,)).fetchall()
-
-    # Overdue Books
-    overdue_books = conn.execute('''
-        SELECT ebooks.name, 
-               ebook_requests.return_date 
-        FROM ebooks 
-        JOIN ebook_requests ON ebooks.id = ebook_requests.ebook_id 
-        WHERE ebook_requests.user_id = ? AND ebook_requests.status = "granted" AND ebook_requests.return_date < DATE('now')
-    ''', (user_id,)).fetchall()
-
     # Feedback Given
-    feedback_given = conn.execute('''
+    feedback_given = fetch_rows(conn, '''
         SELECT ebooks.name, 
                feedback.feedback, 
                feedback.feedback_date 
         FROM ebooks 
         JOIN feedback ON ebooks.id = feedback.ebook_id 
         WHERE feedback.user_id = ? 
-    ''', (user_id,)).fetchall()
+    ''', (user_id,))
+
+    dashboard = {
+        # Borrowing History
+        'borrowing_history': (['name', 'request_date', 'return_date'],
+                              [(row['name'], row['request_date'], row['return_date']) for row in requests]),
+        # Current Active Requests
+        'active_requests': (['name', 'request_date', 'return_date'],
+                            [(row['name'], row['request_date'], row['return_date'])
+                             for row in requests if row['status'] == 'granted']),
+        # Overdue Books
+        'overdue_books': (['name', 'return_date'],
+                          [(row['name'], row['return_date']) for row in requests if row['status'] == 'expired']),
+        'feedback_given': feedback_given,
+    }
+    cache.set(key, dashboard, timeout=USER_STATS_TIMEOUT)
+    return dashboard
+
+
+# Dashboard sections that are the same for every user, computed once
+def shared_user_dashboard(conn):
+    key = tagged_key('stats:user:shared', ['table:ebooks'])
+    dashboard = cache.get(key)
+    if dashboard is not None:
+        return dashboard
+
+    dashboard = {
+        # Top Requested Ebooks
+        'top_requested_ebooks': fetch_rows(conn, '''
+            SELECT ebooks.name, 
+                   ebook_stats.request_count 
+            FROM ebook_stats 
+            JOIN ebooks ON ebooks.id = ebook_stats.ebook_id 
+            ORDER BY ebook_stats.request_count DESC 
+            LIMIT 5
+        '''),
+        # Recently Added Ebooks
+        'recently_added_ebooks': fetch_rows(conn, '''
+            SELECT name, author, date_issued 
+            FROM ebooks 
+            ORDER BY date_issued DESC 
+            LIMIT 5
+        '''),
+    }
+    cache.set(key, dashboard, timeout=SHARED_USER_STATS_TIMEOUT)
+    return dashboard
 
-    # Top Requested Ebooks
-    top_requested_ebooks = conn.execute('''
-        SELECT ebooks.name, 
-               COUNT(ebook_requests.id) AS request_count 
-        FROM ebooks 
-        LEFT JOIN ebook_requests ON ebooks.id = ebook_requests.ebook_id 
-        GROUP BY ebooks.name 
-        ORDER BY request_count DESC 
-        LIMIT 5
-    ''').fetchall()
 
-    # Recently Added Ebooks
-    recently_added_ebooks = conn.execute('''
-        SELECT name, author, date_issued 
-        FROM ebooks 
-        ORDER BY date_issued DESC 
-        LIMIT 5
-    ''').fetchall()
+# Function to retrieve statistics for the user
+@stats_bp.route('/stats/user', methods=['GET'])
+@jwt_required()
+def user_stats():
+    current_user: UserIdentity = get_jwt_identity()
 
+    if not is_user(current_user):
+        return jsonify({"message": "You are not a user"}), 403
+    try:
+        fmt = requested_format()
+    except ValueError:
+        return jsonify({"message": "Invalid format parameter!"}), 400
+    
+    conn = get_db_connection()
+    dashboard = {**user_dashboard(conn, current_user['id']), **shared_user_dashboard(conn)}
     conn.close()
 
-    return jsonify({
-        'borrowing_history': [dict(row) for row in borrowing_history],
-        'active_requests': [dict(row) for row in active_requests],
-        'overdue_books': [dict(row) for row in overdue_books],
-        'feedback_given': [dict(row) for row in feedback_given],
-        'top_requested_ebooks': [dict(row) for row in top_requested_ebooks],
-        'recently_added_ebooks': [dict(row) for row in recently_added_ebooks]
-    })
-
+    return encode_response({name: rows_payload(*rows, fmt) for name, rows in dashboard.items()}, fmt)
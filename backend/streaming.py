@@ -0,0 +1,49 @@
+import orjson
+from flask import Response, request, stream_with_context
+from db import get_db_connection
+
+STREAM_BATCH_SIZE = 1000
+
+
+# Streaming mode asked for by the client: "ndjson", "json" (a chunked JSON
+# array) or None for a regular buffered response
+def requested_stream_format():
+    fmt = request.args.get("stream")
+    if fmt in ("ndjson", "json"):
+        return fmt
+    if request.accept_mimetypes.best == "application/x-ndjson":
+        return "ndjson"
+    return None
+
+
+# Run the query and stream its rows with bounded memory: rows are read in
+# fetchmany batches and each batch is serialized and sent before the next
+# one is read.
+def stream_query(query, params=(), fmt="ndjson", batch_size=STREAM_BATCH_SIZE):
+    def generate():
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute(query, params)
+            columns = [column[0] for column in cursor.description]
+            first = True
+            if fmt == "json":
+                yield b"["
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                lines = [orjson.dumps(dict(zip(columns, row))) for row in rows]
+                if fmt == "ndjson":
+                    yield b"\n".join(lines) + b"\n"
+                else:
+                    yield (b"" if first else b",") + b",".join(lines)
+                first = False
+            if fmt == "json":
+                yield b"]"
+        finally:
+            conn.close()
+
+    mimetype = "application/x-ndjson" if fmt == "ndjson" else "application/json"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
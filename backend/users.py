@@ -1,8 +1,11 @@
+import sqlite3
 from typing import TypedDict
 from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from db import get_db_connection
+from cache import invalidate
+from passwords import HashPoolBusy, check_and_upgrade, hash_password
+from streaming import requested_stream_format, stream_query
 
 
 users_bp = Blueprint("auth", __name__)
@@ -18,8 +21,27 @@ def is_librarian(user: UserIdentity) -> bool:
 def is_user(user: UserIdentity) -> bool:
     return user['role'] == 'user'
 
+# Response for requests turned away while the password hash pool is saturated
+def hash_pool_busy():
+    return jsonify({"message": "Too many login attempts, please try again!"}), 503, {"Retry-After": "1"}
+
+# Look up a user and check their password. Returns None on bad credentials.
+def authenticate(username, password):
+    conn = get_db_connection()
+    try:
+        user = conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+        if user is None or not check_and_upgrade(conn, user, password):
+            return None
+        return user
+    finally:
+        conn.close()
+
 @users_bp.route("/get-users", methods=["GET"])
 def get_users():
+    fmt = requested_stream_format()
+    if fmt:
+        return stream_query("SELECT id, username, role FROM users WHERE role = ?", ("user",), fmt=fmt)
+
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id, username, role FROM users WHERE role = ?", ("user",))
@@ -46,28 +68,30 @@ def register():
     if not username or not password:
         return jsonify({"message": "Username and password are required!"}), 400
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-    user = cursor.fetchone()
-    conn.close()
+    try:
+        hashed_password = hash_password(password)
+    except HashPoolBusy:
+        return hash_pool_busy()
 
-    if user:
+    # The unique index on username rejects duplicates atomically
+    conn = get_db_connection()
+    try:
+        user = conn.execute(
+            """
+            INSERT INTO users (username, password, role)
+            VALUES (?, ?, ?)
+            RETURNING id, username, role
+            """,
+            (username, hashed_password, "user"),
+        ).fetchone()
+        conn.commit()
+    except sqlite3.IntegrityError:
+        conn.rollback()
         return jsonify({"message": "Username already exists!"}), 400
+    finally:
+        conn.close()
 
-    hashed_password = generate_password_hash(password)
-
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        INSERT INTO users (username, password, role)
-        VALUES (?, ?, ?)
-        """,
-        (username, hashed_password, "user"),
-    )
-    conn.commit()
-    conn.close()
+    invalidate("table:users")
 
     access_token = create_access_token(
         identity={"id": user["id"], "username": user["username"], "role": user["role"]},
@@ -96,13 +120,12 @@ def login():
     if not username or not password:
         return jsonify({"message": "Username and password are required!"}), 400
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-    user = cursor.fetchone()
-    conn.close()
+    try:
+        user = authenticate(username, password)
+    except HashPoolBusy:
+        return hash_pool_busy()
 
-    if user is None or not check_password_hash(user["password"], password):
+    if user is None:
         return jsonify({"message": "Invalid username or password!"}), 401
 
     if user["role"] != "user":
@@ -135,13 +158,12 @@ def librarian_login():
     if not username or not password:
         return jsonify({"message": "Username and password are required!"}), 400
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-    user = cursor.fetchone()
-    conn.close()
+    try:
+        user = authenticate(username, password)
+    except HashPoolBusy:
+        return hash_pool_busy()
 
-    if user is None or not check_password_hash(user["password"], password):
+    if user is None:
         return jsonify({"message": "Invalid username or password"}), 401
 
     if user["role"] != "librarian":
@@ -0,0 +1,217 @@
+import atexit
+import concurrent.futures
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from db import get_db_connection, is_locked_error, write_transaction
+
+# Inserts are committed in groups by one writer thread: a batch is closed
+# after WRITE_QUEUE_MAX_ROWS rows or WRITE_QUEUE_MAX_DELAY_MS after its first
+# row, whichever comes first. At most WRITE_QUEUE_SIZE rows wait; callers
+# wait up to WRITE_QUEUE_PUT_TIMEOUT seconds for room and are turned away
+# after that.
+WRITE_QUEUE_MAX_ROWS = int(os.getenv("WRITE_QUEUE_MAX_ROWS") or 500)
+WRITE_QUEUE_MAX_DELAY_MS = float(os.getenv("WRITE_QUEUE_MAX_DELAY_MS") or 5)
+WRITE_QUEUE_SIZE = int(os.getenv("WRITE_QUEUE_SIZE") or 10000)
+WRITE_QUEUE_PUT_TIMEOUT = float(os.getenv("WRITE_QUEUE_PUT_TIMEOUT") or 1)
+# Longest a durable acknowledgement waits for its batch to commit
+WRITE_QUEUE_ACK_TIMEOUT = float(os.getenv("WRITE_QUEUE_ACK_TIMEOUT") or 30)
+
+# Acknowledgement modes: "durable" answers once the row is committed,
+# "queued" as soon as it is in the queue
+ACK_MODES = ("durable", "queued")
+
+logger = logging.getLogger("write_queue")
+
+
+# Raised when the queue is full or stopped, or a commit takes too long
+class WriteQueueBusy(Exception):
+    pass
+
+
+class _Write:
+    __slots__ = ("sql", "params", "after_commit", "future")
+
+    def __init__(self, sql, params, after_commit):
+        self.sql = sql
+        self.params = params
+        self.after_commit = after_commit
+        self.future = concurrent.futures.Future()
+
+
+# Write-behind queue: handlers submit single-row statements and one thread
+# runs them in batches, each batch in one transaction and one commit
+class WriteQueue:
+    def __init__(self):
+        self.enabled = False
+        self.ack = "durable"
+        self._app = None
+        self._queue = None
+        self._thread = None
+        self._stopping = threading.Event()
+        # Set by stop(); no writer is started again until the next init_app
+        self._stopped = False
+        self._pid = None
+        self._lock = threading.Lock()
+        self.counters = {"submitted": 0, "committed": 0, "failed": 0, "rejected": 0, "batches": 0, "largest_batch": 0}
+
+    @property
+    def durable(self):
+        return self.ack == "durable"
+
+    def init_app(self, app):
+        self._app = app
+        self.enabled = app.config["WRITE_QUEUE_ENABLED"]
+        self.ack = app.config["WRITE_QUEUE_ACK"]
+        self._stopped = False
+        if self.ack not in ACK_MODES:
+            raise ValueError(f"WRITE_QUEUE_ACK must be one of {', '.join(ACK_MODES)}")
+        if self.enabled:
+            # Commit what is still queued when the interpreter exits
+            atexit.register(self.stop)
+
+    def _ensure_started(self):
+        # The writer thread doesn't survive a fork, start a new one in the child
+        with self._lock:
+            if self._stopped:
+                raise WriteQueueBusy()
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(WRITE_QUEUE_SIZE)
+            self._stopping = threading.Event()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="write-queue", daemon=True)
+            self._thread.start()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    # Queue a statement. after_commit(rowcount) runs on the writer thread,
+    # in an app context, once the statement is committed. Returns a Future
+    # of the rowcount.
+    def submit(self, sql, params, after_commit=None):
+        self._ensure_started()
+        write = _Write(sql, params, after_commit)
+        try:
+            self._queue.put(write, timeout=WRITE_QUEUE_PUT_TIMEOUT)
+        except queue.Full:
+            self.count("rejected")
+            raise WriteQueueBusy()
+        self.count("submitted")
+        return write.future
+
+    # Submit and, in durable mode, wait for the commit. Returns the rowcount,
+    # or None when the write was only queued.
+    def write(self, sql, params, after_commit=None):
+        future = self.submit(sql, params, after_commit)
+        if not self.durable:
+            return None
+        try:
+            return future.result(WRITE_QUEUE_ACK_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            # Only answer 503 if the write is sure not to happen; once the
+            # writer has picked it up, wait for its batch instead
+            if future.cancel():
+                raise WriteQueueBusy()
+            return future.result()
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + WRITE_QUEUE_MAX_DELAY_MS / 1000
+        while len(batch) < WRITE_QUEUE_MAX_ROWS:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # Keep going after a stop request until the queue is drained
+        while True:
+            batch = self._next_batch()
+            if batch:
+                try:
+                    self._commit(batch)
+                except Exception:
+                    logger.exception("Committing a batch of %d writes failed", len(batch))
+            elif self._stopping.is_set() and self._queue.empty():
+                return
+
+    def _commit(self, batch):
+        # Writes given up on by their caller are dropped; the rest can no
+        # longer be cancelled
+        batch = [write for write in batch if write.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        # A failing row (a constraint, say) only rolls back its own
+        # statement; lock errors abort the batch and are retried
+        def work(conn):
+            results = []
+            for write in batch:
+                try:
+                    results.append(conn.execute(write.sql, write.params).rowcount)
+                except sqlite3.Error as error:
+                    if is_locked_error(error):
+                        raise
+                    results.append(error)
+            return results
+
+        with self._app.app_context():
+            conn = get_db_connection()
+            try:
+                results = write_transaction(conn, work)
+            except Exception as error:
+                self.count("failed", len(batch))
+                for write in batch:
+                    write.future.set_exception(error)
+                return
+            finally:
+                conn.close()
+
+            with self._lock:
+                self.counters["batches"] += 1
+                self.counters["largest_batch"] = max(self.counters["largest_batch"], len(batch))
+            for write, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    self.count("failed")
+                    write.future.set_exception(result)
+                    continue
+                self.count("committed")
+                if write.after_commit is not None:
+                    try:
+                        write.after_commit(result)
+                    except Exception:
+                        logger.exception("After-commit hook failed")
+                write.future.set_result(result)
+
+    # Stop taking writes, commit everything queued and stop the writer
+    def stop(self, timeout=30):
+        with self._lock:
+            thread = self._thread if self._pid == os.getpid() else None
+            self._stopped = True
+            self._stopping.set()
+        if thread is not None:
+            thread.join(timeout)
+        with self._lock:
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "ack": self.ack,
+                "queued": self._queue.qsize() if self._queue is not None else 0,
+                **self.counters,
+            }
+
+
+write_queue = WriteQueue()
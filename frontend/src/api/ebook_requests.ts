@@ -42,6 +42,18 @@ export async function updateEbookRequest(ebookRequest: DBEbookRequest) {
   return response.data
 }
 
+export interface EbookRequestBatchResult {
+  id: number
+  status: string
+  result: 'updated' | 'not_found' | 'invalid'
+}
+
+// Update the status of many ebook requests in one call
+export async function updateEbookRequestsBatch(updates: { id: number; status: string }[]) {
+  const response = await axiosInstance.put('/ebook_requests/batch', { updates })
+  return response.data as { updated: number; results: EbookRequestBatchResult[] }
+}
+
 // Delete an ebook request
 export async function deleteEbookRequest(id: number) {
   const response = await axiosInstance.delete(`/ebook_requests/${id}`)
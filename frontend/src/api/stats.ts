@@ -3,6 +3,7 @@ import { useAuthStore } from '@/stores/auth'
 
 // Interfaces for Librarian Stats
 export interface EbookActivity {
+  id: number
   name: string
   request_count: number
 }
@@ -24,6 +25,7 @@ export interface ActiveRequest {
 export interface OverdueRequest extends ActiveRequest {}
 
 export interface UserActivity {
+  id: number
   username: string
   total_requests: number
   granted_requests: number
@@ -45,10 +47,14 @@ export interface LibrarianStats {
   total_ebooks: number
   total_sections: number
   ebook_activity: EbookActivity[]
+  ebook_activity_next_cursor: number | null
   top_borrowed_ebooks: TopBorrowedEbook[]
   active_requests: ActiveRequest[]
+  active_requests_next_cursor: number | null
   overdue_requests: OverdueRequest[]
+  overdue_requests_next_cursor: number | null
   user_activity: UserActivity[]
+  user_activity_next_cursor: number | null
   feedback_overview: FeedbackOverview[]
   ebooks_by_section: EbooksBySection[]
 }
@@ -98,10 +104,20 @@ export interface UserStats {
   recently_added_ebooks: RecentlyAddedEbook[]
 }
 
-// API call to get librarian statistics
-export async function getLibrarianStats() {
+// Cursors of the paginated lists in the librarian stats, each one the
+// *_next_cursor of the page before
+export interface LibrarianStatsCursors {
+  ebook_cursor?: number
+  user_cursor?: number
+  active_cursor?: number
+  overdue_cursor?: number
+}
+
+// API call to get librarian statistics, optionally a later page of its lists
+export async function getLibrarianStats(cursors: LibrarianStatsCursors = {}) {
   const response = await axiosInstance.get('/stats/librarian', {
-    headers: { Authorization: `Bearer ${useAuthStore().token}` }
+    headers: { Authorization: `Bearer ${useAuthStore().token}` },
+    params: cursors
   })
   return response.data as LibrarianStats
 }